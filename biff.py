@@ -0,0 +1,313 @@
+from cfb import CompoundFile
+from struct import Struct
+
+# Reads cell values from the Workbook stream of Excel 97 (BIFF8) files,
+# one row at a time. Only the shared string table is kept in memory.
+
+RecordHeader = Struct("<HH")
+Cell = Struct("<HHH")  # rw, col, ixfe
+unsigned1 = Struct("<B")
+unsigned2 = Struct("<H")
+unsigned4 = Struct("<L")
+unsigned8 = Struct("<Q")
+signed4 = Struct("<l")
+double = Struct("<d")
+RowCol = Struct("<HH")
+SstHeader = Struct("<LL")  # cstTotal, cstUnique
+Boundsheet = Struct("<LBB")  # lbPlyPos, hsState, dt
+Dimensions = Struct("<LLHH2x")  # rwMic, rwMac, colMic, colMac
+
+BOF = 0x0809
+EOF = 0x000A
+BOUNDSHEET = 0x0085
+SST = 0x00FC
+CONTINUE = 0x003C
+DIMENSIONS = 0x0200
+LABELSST = 0x00FD
+LABEL = 0x0204
+NUMBER = 0x0203
+RK = 0x027E
+MULRK = 0x00BD
+BOOLERR = 0x0205
+FORMULA = 0x0006
+STRING = 0x0207
+
+BIFF8 = 0x0600
+WORKSHEET = 0
+
+HIGH_BYTE_BIT = 0
+EXT_ST_BIT = 2
+RICH_ST_BIT = 3
+
+class Workbook(object):
+    """Streams the rows of the worksheets in an Excel 97 workbook"""
+    
+    def __init__(self, file):
+        self._ole = CompoundFile(file)
+        try:
+            self._stream = self._ole.openstream("Workbook")
+            self._sheets = list()  # [(name, offset) for each worksheet]
+            self._sst = list()
+            self._read_globals()
+        except:
+            self._ole.close()
+            raise
+    
+    def close(self):
+        self._stream = None
+        self._ole.close()
+    
+    @property
+    def nsheets(self):
+        return len(self._sheets)
+    
+    def sheet_name(self, i):
+        return self._sheets[i][0]
+    
+    def _read_globals(self):
+        records = iter_records(self._stream)
+        [type, data] = next(records)
+        assert type == BOF
+        [vers] = unsigned2.unpack_from(data)
+        if vers != BIFF8:
+            raise ValueError("Only Excel 97 (BIFF8) workbooks are supported")
+        sst = None
+        for [type, data] in records:
+            if type == CONTINUE and sst is not None:
+                sst.append(data)
+                continue
+            if sst is not None:
+                self._sst = parse_sst(sst)
+                sst = None
+            
+            if type == EOF:
+                break
+            if type == BOUNDSHEET:
+                [offset, _, dt] = Boundsheet.unpack_from(data)
+                if dt == WORKSHEET:
+                    name = ContinuedReader((data,))
+                    name.skip(Boundsheet.size)
+                    [cch] = name.read(1)
+                    self._sheets.append((name.read_chars(cch), offset))
+            elif type == SST:
+                sst = [data]
+    
+    def nrows(self, i):
+        """Number of rows according to the sheet's DIMENSIONS record"""
+        records = self._sheet_records(i)
+        for [type, data] in records:
+            if type == DIMENSIONS:
+                [_, rwMac, _, _] = Dimensions.unpack_from(data)
+                return rwMac
+            if type in CELL_TYPES:
+                break
+        return None
+    
+    def iter_rows(self, i):
+        """Yields a list of values for each row of a sheet
+        
+        Blank cells are None. Rows are not padded to the same length.
+        """
+        
+        row = list()
+        rowx = 0
+        records = self._sheet_records(i)
+        for [type, data] in records:
+            if type == FORMULA:
+                cells = formula_cell(data, records)
+            else:
+                try:
+                    parse = CELL_TYPES[type]
+                except LookupError:
+                    continue
+                cells = parse(self, data)
+            for [r, c, value] in cells:
+                while rowx < r:
+                    yield row
+                    row = list()
+                    rowx += 1
+                if c >= len(row):
+                    row.extend(None for _ in range(c + 1 - len(row)))
+                row[c] = value
+        if row:
+            yield row
+    
+    def _sheet_records(self, i):
+        """Yields the records of a sheet, excluding embedded substreams"""
+        self._stream.seek(self._sheets[i][1])
+        records = iter_records(self._stream)
+        [type, _] = next(records)
+        assert type == BOF
+        depth = 1
+        for [type, data] in records:
+            if type == BOF:
+                depth += 1
+            elif type == EOF:
+                depth -= 1
+                if not depth:
+                    break
+            elif depth == 1:
+                yield (type, data)
+    
+    def _labelsst(self, data):
+        [rw, col, _] = Cell.unpack_from(data)
+        [isst] = unsigned4.unpack_from(data, Cell.size)
+        return ((rw, col, self._sst[isst]),)
+    
+    def _label(self, data):
+        [rw, col, _] = Cell.unpack_from(data)
+        return ((rw, col, read_string(data[Cell.size:])),)
+    
+    def _number(self, data):
+        [rw, col, _] = Cell.unpack_from(data)
+        [value] = double.unpack_from(data, Cell.size)
+        return ((rw, col, value),)
+    
+    def _rk(self, data):
+        [rw, col, _] = Cell.unpack_from(data)
+        [rk] = signed4.unpack_from(data, Cell.size)
+        return ((rw, col, rk_value(rk)),)
+    
+    def _mulrk(self, data):
+        [rw, col] = RowCol.unpack_from(data)
+        cells = list()
+        for offset in range(4 + 2, len(data) - 2, 2 + 4):
+            [rk] = signed4.unpack_from(data, offset)
+            cells.append((rw, col, rk_value(rk)))
+            col += 1
+        return cells
+    
+    def _boolerr(self, data):
+        [rw, col, _] = Cell.unpack_from(data)
+        [value] = unsigned1.unpack_from(data, Cell.size)
+        return ((rw, col, value),)
+
+CELL_TYPES = {
+    LABELSST: Workbook._labelsst,
+    LABEL: Workbook._label,
+    NUMBER: Workbook._number,
+    RK: Workbook._rk,
+    MULRK: Workbook._mulrk,
+    BOOLERR: Workbook._boolerr,
+    FORMULA: None,
+}
+
+def formula_cell(data, records):
+    """Cached result of a formula, possibly reading a following STRING"""
+    [rw, col, _] = Cell.unpack_from(data)
+    result = data[Cell.size:Cell.size + 8]
+    if result[6:8] != b"\xFF\xFF":
+        [value] = double.unpack(result)
+    elif result[0] == 0:
+        for [type, data] in records:
+            if type == STRING:
+                break
+        value = read_string(data)
+    elif result[0] in {1, 2}:  # Boolean or error code
+        value = result[2]
+    else:
+        value = ""
+    return ((rw, col, value),)
+
+def rk_value(rk):
+    if rk & 2:
+        value = float(rk >> 2)
+    else:
+        # Most significant 30 bits of a double
+        [value] = double.unpack(unsigned8.pack((rk & 0xFFFFFFFC) << 32))
+    if rk & 1:
+        value /= 100
+    return value
+
+def iter_records(stream):
+    while True:
+        header = stream.read(RecordHeader.size)
+        if len(header) < RecordHeader.size:
+            break
+        [type, size] = RecordHeader.unpack(header)
+        data = stream.read(size)
+        if len(data) < size:
+            raise EOFError("Truncated BIFF record")
+        yield (type, data)
+
+def read_string(data):
+    """Decodes an XLUnicodeString"""
+    reader = ContinuedReader((data,))
+    [cch] = unsigned2.unpack(reader.read(2))
+    return reader.read_chars(cch)
+
+def parse_sst(chunks):
+    """Decodes the strings from an SST record and its CONTINUE records"""
+    reader = ContinuedReader(chunks)
+    [_, cstUnique] = SstHeader.unpack(reader.read(SstHeader.size))
+    strings = list()
+    for _ in range(cstUnique):
+        [cch] = unsigned2.unpack(reader.read(2))
+        [flags] = reader.read(1)
+        cRun = 0
+        cbExtRst = 0
+        if flags >> RICH_ST_BIT & 1:
+            [cRun] = unsigned2.unpack(reader.read(2))
+        if flags >> EXT_ST_BIT & 1:
+            [cbExtRst] = unsigned4.unpack(reader.read(4))
+        strings.append(reader.read_chars(cch, flags >> HIGH_BYTE_BIT & 1))
+        reader.skip(4 * cRun + cbExtRst)
+    return strings
+
+class ContinuedReader(object):
+    """Reads data split over a record and its CONTINUE records
+    
+    Character data split across records starts each continuation with a
+    new flags byte, saying whether the remaining characters are compressed.
+    """
+    
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._chunk = b""
+        self._offset = 0
+    
+    def _next_chunk(self):
+        self._chunk = next(self._chunks)
+        self._offset = 0
+    
+    def read(self, size):
+        result = bytearray()
+        while len(result) < size:
+            if self._offset >= len(self._chunk):
+                self._next_chunk()
+            end = self._offset + size - len(result)
+            result += self._chunk[self._offset:end]
+            self._offset = min(end, len(self._chunk))
+        return bytes(result)
+    
+    def skip(self, size):
+        while size:
+            if self._offset >= len(self._chunk):
+                self._next_chunk()
+            n = min(size, len(self._chunk) - self._offset)
+            self._offset += n
+            size -= n
+    
+    def read_chars(self, cch, high_byte=None):
+        """Reads cch characters
+        
+        If high_byte is None, a flags byte is read first.
+        """
+        
+        if high_byte is None:
+            [flags] = self.read(1)
+            high_byte = flags >> HIGH_BYTE_BIT & 1
+        parts = list()
+        while cch:
+            if self._offset >= len(self._chunk):
+                self._next_chunk()
+                high_byte = self._chunk[0] >> HIGH_BYTE_BIT & 1
+                self._offset = 1
+            size = 1 + high_byte
+            n = min(cch, (len(self._chunk) - self._offset) // size)
+            end = self._offset + n * size
+            data = self._chunk[self._offset:end]
+            parts.append(data.decode("utf-16-le" if high_byte else "latin-1"))
+            self._offset = end
+            cch -= n
+        return "".join(parts)
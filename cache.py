@@ -0,0 +1,214 @@
+import os
+from os import path
+import pickle
+from hashlib import blake2b
+from contextlib import (closing, contextmanager)
+from functools import partial
+from sys import stderr
+from tempfile import NamedTemporaryFile
+from collections.abc import Sequence
+
+VERSION = 2
+LIMIT = 256 * 2**20
+SUFFIX = ".pickle"
+CHUNK = 1000
+
+def default_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = path.join(path.expanduser("~"), ".cache")
+    return path.join(base, "reveg-db")
+
+class Cache(object):
+    """Pickled records parsed from source files
+    
+    Entries are keyed by the source file's path, size, modification time
+    and a hash of its contents. The least recently used entries are removed
+    when the directory grows past the size limit.
+    """
+    
+    def __init__(self, dir=None, limit=LIMIT):
+        if dir is None:
+            dir = default_dir()
+        self.dir = dir
+        self.limit = limit
+    
+    def read(self, Reader, file, fields=None, **options):
+        """Returns a Records sequence of everything produced by Reader(file)
+        
+        The fields parameter is passed on to the reader, and separate
+        entries are kept for each selection of fields. Other options are
+        passed on but are assumed not to affect the records.
+        """
+        
+        name = "{}.{}".format(Reader.__module__, Reader.__qualname__)
+        if fields is not None:
+            name += "[{}]".format(",".join(sorted(fields)))
+        return self.load(file, name, partial(read_all, Reader, file, fields, **options))
+    
+    def load(self, file, name, build):
+        """Returns the result of build(), cached against the file contents
+        
+        The name distinguishes different kinds of results for the same
+        file.
+        """
+        
+        file = path.abspath(file)
+        stat = os.stat(file)
+        entry = path.join(self.dir, entry_name(name, file))
+        digest = None
+        fresh = False
+        try:
+            with open(entry, "rb") as reader:
+                [version, size, mtime, cached_digest] = pickle.load(reader)
+                fresh = version == VERSION and size == stat.st_size
+                if fresh and mtime != stat.st_mtime_ns:
+                    digest = file_digest(file)
+                    fresh = digest == cached_digest
+                if fresh:
+                    value = pickle.load(reader)
+        except FileNotFoundError:
+            pass
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as err:
+            print("Ignoring cache entry {}: {}".format(entry, err),
+                file=stderr)
+            fresh = False
+        if fresh:
+            if digest is None:
+                os.utime(entry)
+            else:
+                # Touched but not modified; record the new time
+                self.store(entry, stat, digest, value)
+            return value
+        
+        if digest is None:
+            digest = file_digest(file)
+        value = build()
+        self.store(entry, stat, digest, value)
+        return value
+    
+    def store(self, entry, stat, digest, value):
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            with NamedTemporaryFile("wb", dir=self.dir, suffix=".tmp",
+            delete=False) as writer:
+                try:
+                    header = (VERSION, stat.st_size, stat.st_mtime_ns, digest)
+                    pickle.dump(header, writer, pickle.HIGHEST_PROTOCOL)
+                    pickle.dump(value, writer, pickle.HIGHEST_PROTOCOL)
+                except:
+                    writer.close()
+                    os.remove(writer.name)
+                    raise
+            os.replace(writer.name, entry)
+            self.evict(entry)
+        except OSError as err:
+            print("Cannot write cache entry {}: {}".format(entry, err),
+                file=stderr)
+    
+    def evict(self, keep):
+        entries = list()
+        for name in os.listdir(self.dir):
+            if not name.endswith(SUFFIX):
+                continue
+            entry = path.join(self.dir, name)
+            try:
+                stat = os.stat(entry)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        
+        total = 0
+        for [_, size, entry] in sorted(entries, reverse=True):
+            total += size
+            if total > self.limit and entry != keep:
+                try:
+                    os.remove(entry)
+                except FileNotFoundError:
+                    pass
+
+def entry_name(name, file):
+    key = "{}\0{}".format(name, file).encode("utf-8", "surrogatepass")
+    return blake2b(key, digest_size=16).hexdigest() + SUFFIX
+
+def file_digest(file):
+    digest = blake2b()
+    with open(file, "rb") as reader:
+        while True:
+            chunk = reader.read(0x10000)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+def read_all(Reader, file, fields=None, **options):
+    with closing(Reader(file, fields=fields, **options)) as reader:
+        return Records(list(reader))
+
+class Records(Sequence):
+    """Records pickled in chunks, which are only unpickled when accessed"""
+    
+    def __init__(self, records, chunk=CHUNK):
+        self._len = len(records)
+        self._chunk = chunk
+        self._chunks = list()
+        for start in range(0, self._len, chunk):
+            records_chunk = records[start:start + chunk]
+            self._chunks.append(
+                pickle.dumps(records_chunk, pickle.HIGHEST_PROTOCOL))
+        self._loaded = (None, None)
+    
+    def __getstate__(self):
+        return (self._len, self._chunk, self._chunks)
+    
+    def __setstate__(self, state):
+        [self._len, self._chunk, self._chunks] = state
+        self._loaded = (None, None)
+    
+    def __len__(self):
+        return self._len
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            [start, stop, step] = i.indices(self._len)
+            if step != 1:
+                return list(self[i] for i in range(start, stop, step))
+            result = list()
+            while start < stop:
+                [c, offset] = divmod(start, self._chunk)
+                chunk = self._get_chunk(c)
+                end = min(len(chunk), offset + stop - start)
+                result.extend(chunk[offset:end])
+                start += end - offset
+            return result
+        [c, offset] = divmod(range(self._len)[i], self._chunk)
+        return self._get_chunk(c)[offset]
+    
+    def __iter__(self):
+        for c in range(len(self._chunks)):
+            yield from self._get_chunk(c)
+    
+    def _get_chunk(self, c):
+        [loaded, chunk] = self._loaded
+        if loaded != c:
+            chunk = pickle.loads(self._chunks[c])
+            self._loaded = (c, chunk)
+        return chunk
+
+@contextmanager
+def open_cached(cache, Reader, file, fields=None, filter=None, **options):
+    """Context manager giving the records from Reader(file)
+    
+    If cache is None, the reader is used directly. Otherwise the filter is
+    applied to the cached records.
+    """
+    
+    if cache is None:
+        reader = Reader(file, fields=fields, filter=filter, **options)
+        with closing(reader):
+            yield reader
+    else:
+        records = cache.read(Reader, file, fields, **options)
+        if filter is not None:
+            records = (record for record in records if filter(record))
+        yield records
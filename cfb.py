@@ -0,0 +1,289 @@
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from io import SEEK_SET, SEEK_CUR, SEEK_END
+from io import BufferedIOBase
+from array import array
+from bisect import bisect_right
+
+# Reads streams from OLE compound files (Word 97 and Excel 97 documents)
+# through a memory map, without copying the streams into memory
+
+SIGNATURE = bytes.fromhex("D0CF11E0A1B11AE1")
+Header = Struct("<"
+    "8s"  # Signature
+    "16x"  # CLSID
+    "H"  # Minor version
+    "H"  # Major version
+    "2x"  # Byte order
+    "H"  # Sector shift
+    "H"  # Mini sector shift
+    "6x"
+    "L"  # Number of directory sectors
+    "L"  # Number of FAT sectors
+    "L"  # First directory sector
+    "4x"  # Transaction signature
+    "L"  # Mini stream cutoff size
+    "L"  # First mini FAT sector
+    "L"  # Number of mini FAT sectors
+    "L"  # First DIFAT sector
+    "L"  # Number of DIFAT sectors
+)
+HEADER_DIFAT = 109
+DirEntry = Struct("<"
+    "64s"  # Name, UTF-16
+    "H"  # Name length in bytes, including the terminator
+    "B"  # Object type
+    "x"  # Colour
+    "L"  # Left sibling
+    "L"  # Right sibling
+    "L"  # Child
+    "16x"  # CLSID
+    "4x"  # State bits
+    "8x"  # Creation time
+    "8x"  # Modified time
+    "L"  # Starting sector
+    "Q"  # Stream size
+)
+STORAGE = 1
+STREAM = 2
+ROOT = 5
+MAX_REG_SECT = 0xFFFFFFFA
+ENDOFCHAIN = 0xFFFFFFFE
+NOSTREAM = 0xFFFFFFFF
+
+class CompoundFile(object):
+    """Streams of a compound file, mapped into memory
+    
+    The openstream() and exists() methods work like those of OleFileIO,
+    but only for streams directly in the root storage. Problems that do
+    not stop the file being read are listed in parsing_issues, as
+    (exception type, message) tuples, also like OleFileIO.
+    
+    Closing releases the views held by the streams, but views obtained
+    from them must be freed first, or closing raises BufferError.
+    """
+    
+    def __init__(self, file):
+        self.parsing_issues = list()
+        with open(file, "rb") as file:
+            self._map = mmap(file.fileno(), 0, access=ACCESS_READ)
+        self._streams = list()
+        try:
+            self._view = memoryview(self._map)
+            header = Header.unpack_from(self._view)
+            [signature, _, major, sector_shift, mini_shift, _, nfat,
+                dir_start, self._mini_cutoff, minifat_start, _,
+                difat_start, ndifat] = header
+            if signature != SIGNATURE:
+                raise ValueError("Not an OLE compound file")
+            if (major, sector_shift) not in {(3, 9), (4, 12)}:
+                self._issue("Unexpected version {} with sector shift {}"
+                    .format(major, sector_shift))
+            if mini_shift != 6:
+                self._issue("Unexpected mini sector shift {}".format(
+                    mini_shift))
+            self._sector_size = 1 << sector_shift
+            self._mini_size = 1 << mini_shift
+            if len(self._map) % self._sector_size:
+                self._issue("File size is not a multiple of the sector size")
+            
+            difat = list(Struct("<{}L".format(HEADER_DIFAT)).unpack_from(
+                self._view, Header.size))
+            per_sector = self._sector_size // 4
+            sector = difat_start
+            for _ in range(ndifat):
+                entries = Struct("<{}L".format(per_sector)).unpack_from(
+                    self._view, self._offset(sector))
+                difat.extend(entries[:-1])
+                sector = entries[-1]
+            self._fat = array("L")
+            for sector in difat[:nfat]:
+                entries = Struct("<{}L".format(per_sector)).unpack_from(
+                    self._view, self._offset(sector))
+                self._fat.extend(entries)
+            
+            dir = self._stream(dir_start, None)
+            entries = list()
+            for offset in range(0, dir.size, DirEntry.size):
+                entry = dir.view(offset, DirEntry.size)
+                entries.append(DirEntry.unpack(entry))
+            [_, _, type, _, _, child, mini_start, mini_size] = entries[0]
+            if type != ROOT:
+                raise ValueError("Missing root directory entry")
+            if major == 3:
+                mini_size &= 0xFFFFFFFF
+            self._ministream = self._stream(mini_start, mini_size)
+            minifat = self._stream(minifat_start, None)
+            self._minifat = array("L",
+                (sector for [sector] in unsigned4.iter_unpack(minifat.read())))
+            
+            self._entries = dict()
+            stack = [child]
+            while stack:
+                i = stack.pop()
+                if i == NOSTREAM:
+                    continue
+                [name, length, type, left, right, _, start, size] = entries[i]
+                stack.extend((left, right))
+                if major == 3:
+                    size &= 0xFFFFFFFF
+                name = name[:max(length - 2, 0)].decode("utf-16-le")
+                if type not in {STORAGE, STREAM}:
+                    self._issue("Unexpected type {} for entry {!r}".format(
+                        type, name))
+                    continue
+                if name.casefold() in self._entries:
+                    self._issue("Duplicate entry {!r}".format(name))
+                    continue
+                self._entries[name.casefold()] = (type, start, size)
+        except:
+            entry = None
+            self.close()
+            raise
+    
+    def close(self):
+        for stream in self._streams:
+            stream.close()
+        self._streams.clear()
+        self._view.release()
+        self._map.close()
+    
+    def exists(self, name):
+        return root_name(name) in self._entries
+    
+    def openstream(self, name):
+        [type, start, size] = self._entries[root_name(name)]
+        if type != STREAM:
+            raise ValueError("Not a stream: {}".format(name))
+        if size < self._mini_cutoff:
+            sectors = chain(self._minifat, start)
+            stream = Stream(self._ministream.view, sectors, self._mini_size,
+                size)
+            self._streams.append(stream)
+            return stream
+        return self._stream(start, size)
+    
+    def _stream(self, start, size):
+        sectors = chain(self._fat, start)
+        if size is None:
+            size = len(sectors) * self._sector_size
+        stream = Stream(self._sector_view, sectors, self._sector_size, size)
+        self._streams.append(stream)
+        return stream
+    
+    def _sector_view(self, offset, size):
+        [sector, offset] = divmod(offset, self._sector_size)
+        offset += self._offset(sector)
+        return self._view[offset:offset + size]
+    
+    def _offset(self, sector):
+        return (sector + 1) * self._sector_size
+    
+    def _issue(self, msg):
+        self.parsing_issues.append((ValueError, msg))
+
+def root_name(name):
+    """Key for looking up an entry, which must be in the root storage"""
+    if not isinstance(name, str) or "/" in name:
+        msg = "Only entries in the root storage are supported: {!r}"
+        raise ValueError(msg.format(name))
+    return name.casefold()
+
+unsigned4 = Struct("<L")
+
+def chain(fat, start):
+    """Returns the list of sectors in a chain"""
+    sectors = list()
+    sector = start
+    while sector != ENDOFCHAIN:
+        if sector > MAX_REG_SECT or len(sectors) > len(fat):
+            raise ValueError("Bad sector chain")
+        sectors.append(sector)
+        sector = fat[sector]
+    return sectors
+
+class Stream(BufferedIOBase):
+    """File object for a stream, also giving memoryviews of its data
+    
+    Each run of consecutive sectors is a single view of the underlying
+    data, so a stream stored contiguously is one view of the memory map.
+    """
+    
+    def __init__(self, parent_view, sectors, sector_size, size):
+        self.size = size
+        self._offset = 0
+        self._starts = array("L")
+        self._views = list()
+        offset = 0
+        i = 0
+        while offset < size:
+            if i >= len(sectors):
+                raise EOFError("Sector chain shorter than stream")
+            first = sectors[i]
+            run = 1
+            while i + run < len(sectors) and sectors[i + run] == first + run:
+                run += 1
+            i += run
+            length = min(run * sector_size, size - offset)
+            view = parent_view(first * sector_size, length)
+            if len(view) < length:
+                raise EOFError("Truncated compound file")
+            self._starts.append(offset)
+            self._views.append(view)
+            offset += length
+    
+    def close(self):
+        for view in self._views:
+            view.release()
+        self._views.clear()
+        super().close()
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def view(self, offset, size=None):
+        """Returns data from the stream without moving the file position
+        
+        The result is a memoryview of the memory map, unless it spans
+        separate runs of sectors, in which case it is copied.
+        """
+        
+        if size is None or size > self.size - offset:
+            size = max(self.size - offset, 0)
+        if not size:
+            return memoryview(b"")
+        i = bisect_right(self._starts, offset) - 1
+        start = offset - self._starts[i]
+        view = self._views[i]
+        if start + size <= len(view):
+            return view[start:start + size]
+        
+        data = bytearray(view[start:])
+        while len(data) < size:
+            i += 1
+            data += self._views[i][:size - len(data)]
+        return memoryview(bytes(data))
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size
+        data = bytes(self.view(self._offset, size))
+        self._offset += len(data)
+        return data
+    read1 = read
+    
+    def tell(self):
+        return self._offset
+    
+    def seek(self, offset, base=SEEK_SET):
+        if base == SEEK_CUR:
+            offset += self._offset
+        elif base == SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._offset = offset
+        return self._offset
@@ -6,40 +6,62 @@ from tkwrap import scroll
 from db import (CaCsvReader, FreqCsvReader)
 from excel import (CplExcelReader, FreqExcelReader)
 from db import QuadratReader
-from contextlib import closing
+from cache import (Cache, open_cached)
 import tkinter
-from db import tuple_record
-from operator import attrgetter
-from db import (plant_key, NameSimplifier)
+from db import Record
+from db import plant_key
+from search import (NameIndex, Matches)
+from search import FuzzyIndex
+from itertools import islice
 from sys import stderr
 from tkinter import Toplevel
 from tkinter.ttk import Entry, Frame
-from fnmatch import fnmatchcase
 from functools import partial
+import os
+from os import path
+import pickle
+from tempfile import NamedTemporaryFile
 
-def main(*, ca_csv=(), cpl_excel=(), freqs=(), freqs_csv=(), quad=()):
-    root = Tk()
-    ui = Ui(root)
+def main(*, ca_csv=(), cpl_excel=(), freqs=(), freqs_csv=(), quad=(),
+cache_dir=None, no_cache=False, stream=False, index=None):
+    """
+    index: File to save the merged list and search indexes in. It is used
+    instead of reading the sources while none of them have changed.
+    """
     
-    ui.add_files(CaCsvReader, ca_csv, convert_cpl)
-    ui.add_files(CplExcelReader, cpl_excel, convert_cpl)
-    ui.add_files(FreqExcelReader, freqs, convert_freqs)
-    ui.add_files(FreqCsvReader, freqs_csv, convert_freqs)
-    ui.add_files(QuadratReader, quad)
+    if no_cache:
+        cache = None
+    else:
+        cache = Cache(cache_dir)
     
-    ui.names = list()
-    for (i, (_, item)) in enumerate(sorted(ui.items.items())):
-        ui.list.move(item, "", i)
-        
-        name = ui.list.set(item, 1)
-        level = ui.names
-        leaf = None
-        for word in name.translate(NameSimplifier()).split():
-            if not level or level[-1]["word"] != word:
-                level.append(dict(word=word, children=list()))
-            leaf = level[-1]
-            level = leaf["children"]
-        leaf["name"] = name
+    root = Tk()
+    ui = Ui(root, cache)
+    
+    sources = (
+        (CaCsvReader, ca_csv, convert_cpl, CPL_FIELDS, dict()),
+        (CplExcelReader, cpl_excel, convert_cpl, CPL_FIELDS,
+            dict(streaming=stream)),
+        (FreqExcelReader, freqs, convert_freqs, FREQ_FIELDS,
+            dict(streaming=stream)),
+        (FreqCsvReader, freqs_csv, convert_freqs, FREQ_FIELDS, dict()),
+        (QuadratReader, quad, dict, None, dict()),
+    )
+    saved = None
+    if index is not None:
+        fingerprint = source_fingerprint(sources)
+        saved = load_index(index, fingerprint)
+    if saved is None:
+        for [Reader, files, convert, fields, options] in sources:
+            ui.add_files(Reader, files, convert, fields, **options)
+        plants = ui.fill_list()
+        ui.names = NameIndex(plant.name for plant in plants)
+        ui.fuzzy = FuzzyIndex((plant.name,
+            (plant.name, plant.common, plant.family)) for plant in plants)
+        if index is not None:
+            save_index(index, fingerprint, (ui.items, ui.names, ui.fuzzy))
+    else:
+        [ui.items, ui.names, ui.fuzzy] = saved
+        ui.fill_list()
     
     win = Toplevel(root)
     win.title("Plant entry")
@@ -60,8 +82,55 @@ def main(*, ca_csv=(), cpl_excel=(), freqs=(), freqs_csv=(), quad=()):
     
     root.mainloop()
 
+INDEX_VERSION = 2
+
+def source_fingerprint(sources):
+    """Identifies the source files by their paths, sizes and times"""
+    fingerprint = [INDEX_VERSION]
+    for [Reader, files, _, fields, _] in sources:
+        for file in files:
+            stat = os.stat(file)
+            fingerprint.append((Reader.__qualname__, fields,
+                path.abspath(file), stat.st_size, stat.st_mtime_ns))
+    return fingerprint
+
+def load_index(file, fingerprint):
+    """Returns the saved (items, names, fuzzy) if the fingerprint matches"""
+    try:
+        with open(file, "rb") as reader:
+            if pickle.load(reader) != fingerprint:
+                return None
+            return pickle.load(reader)
+    except FileNotFoundError:
+        return None
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as err:
+        print("Ignoring index {}: {}".format(file, err), file=stderr)
+        return None
+
+def save_index(file, fingerprint, index):
+    dir = path.dirname(path.abspath(file))
+    try:
+        with NamedTemporaryFile("wb", dir=dir, suffix=".tmp",
+        delete=False) as writer:
+            try:
+                pickle.dump(fingerprint, writer, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(index, writer, pickle.HIGHEST_PROTOCOL)
+            except:
+                writer.close()
+                os.remove(writer.name)
+                raise
+        os.replace(writer.name, file)
+    except OSError as err:
+        print("Cannot write index {}: {}".format(file, err), file=stderr)
+
+# Tcl lambda inserting a list of rows at the end of a tree view
+INSERT_ROWS = """{tree rows} {
+    foreach values $rows {$tree insert {} end -values $values}
+}"""
+
 class Ui(object):
-    def __init__(self, window):
+    def __init__(self, window, cache=None):
+        self.cache = cache
         window.title("Reference list")
         
         self.list = Tree(window, tree=False, columns=(
@@ -82,34 +151,42 @@ class Ui(object):
         
         self.items = dict()
         self.records = 0
+        self.search = None
+        self.approx = None
+        self.shown = list()
     
-    def add_files(self, Reader, files, convert=attrgetter("__dict__")):
+    def add_files(self, Reader, files, convert=dict, fields=None,
+    **options):
         for file in files:
             print("Reading", file, file=stderr)
-            with closing(Reader(file)) as file:
+            with open_cached(self.cache, Reader, file, fields,
+            **options) as file:
                 for plant in file:
                     self.add_plant(convert(plant))
             self.print_count()
             print(file=stderr)
     
     def add_plant(self, plant):
-        fields = (
-            "origin", "name", "auth", "common", "famnum", "family", "fam_com",
-            "divnum", "group", "note", "specnum"
-        )
+        """Merges a record into the plant with the same key
+        
+        Fields still missing from the plant are filled in from the record.
+        The list widget is only filled in by fill_list().
+        """
+        
         key = plant_key(plant["name"])
         try:
-            item = self.items[key]
+            current = self.items[key]
         except LookupError:
-            item = self.list.add()
-            self.items[key] = item
+            current = ListRecord()
+            self.items[key] = current
         
-        current = self.list.item(item, option="values")
-        current = tuple_record(current, fields, ("origin",))
-        if getattr(current, "origin", "?") == "?":
-            current.origin = None
-        for field in fields:
-            if getattr(current, field, None) is None:
+        for field in ListRecord.__slots__:
+            value = getattr(current, field)
+            if field == "origin":
+                missing = value in (None, "?")
+            else:
+                missing = value in (None, "")
+            if missing:
                 value = plant.get(field)
                 if value is None:
                     if field == "origin":
@@ -117,58 +194,81 @@ class Ui(object):
                     else:
                         value = ""
                 setattr(current, field, value)
-        self.list.item(item,
-            values=tuple(getattr(current, field) for field in fields))
         
         self.records += 1
         if not self.records % 200:
             self.print_count()
     
+    def fill_list(self):
+        """Adds the merged plants to the list, and returns them sorted
+        
+        The rows are inserted by a loop in Tcl, rather than calling into
+        Tk for each plant.
+        """
+        plants = list(plant for [_, plant] in sorted(self.items.items()))
+        rows = tuple(tuple(plant[field] for field in ListRecord.__slots__)
+            for plant in plants)
+        self.list.tk.call("apply", INSERT_ROWS, self.list, rows)
+        return plants
+    
     def print_count(self):
         print("Records:", self.records, "Plants:", len(self.items), end="\r",
             file=stderr)
     
     def entry_changed(self, value):
         patterns = value.translate(SearchMap()).split()
-        self.matches.delete(*self.matches.get_children())
+        self.value = value
         if patterns:
-            for match in name_matches(self.names, patterns):
-                s = str()
-                i = 0
-                space = True
-                for word in match.split():
-                    if not space:
-                        s += " "
-                    
-                    while i < len(value):
-                        c = value[i]
-                        i += 1
-                        if c.isalnum() or c == "_":
-                            break
-                        s += c
-                    
-                    s += word
-                    
-                    end = i
-                    space = False
-                    while i < len(value):
-                        c = value[i]
-                        i += 1
-                        if c.isalnum() or c == "_":
-                            end = i
-                        elif c.isspace():
-                            space = True
-                            break
-                    s += value[end:i]
-                
-                s += value[i:]
-                self.matches.add(values=(s,))
+            self.search = Matches(self.names, patterns, self.search)
+        else:
+            self.search = None
+        self.approx = None
+        self.show_matches(MATCH_PAGE)
         return True
     
+    def show_matches(self, count):
+        """Shows the first matches, only changing rows that differ
+        
+        If there are not enough names matching the words typed, names
+        approximately matching the entry are listed after them.
+        """
+        
+        if self.search is None:
+            names = ()
+        else:
+            names = self.search.get(count)
+            if len(names) < count:
+                if self.approx is None:
+                    self.approx = self.fuzzy.matches(self.value, MATCH_PAGE)
+                found = set(names)
+                approx = (name for name in self.approx if name not in found)
+                names.extend(islice(approx, count - len(names)))
+        wanted = set(names)
+        kept = list(row for row in self.shown if row[0] in wanted)
+        if list(name for [name, _, _] in kept) != names[:len(kept)]:
+            kept = list()
+        removed = set(item for [_, item, _] in self.shown)
+        removed.difference_update(item for [_, item, _] in kept)
+        if removed:
+            self.matches.delete(*removed)
+        
+        for row in kept:
+            text = format_match(self.value, row[0])
+            if text != row[2]:
+                self.matches.item(row[1], values=(text,))
+                row[2] = text
+        for name in names[len(kept):]:
+            text = format_match(self.value, name)
+            kept.append([name, self.matches.add(values=(text,)), text])
+        self.shown = kept  # [[name, item, text], ...]
+    
     def select_match(self, dir, event):
         focus = self.matches.focus()
         if (focus,) == self.matches.selection():
             new = getattr(self.matches, dir)(focus)
+            if not new and dir == "next":
+                self.show_matches(len(self.shown) + MATCH_PAGE)
+                new = self.matches.next(focus)
             if new:
                 focus = new
         if not focus:
@@ -188,6 +288,12 @@ class Ui(object):
         print(self.entry.get())
         self.entry.delete(0, tkinter.END)
 
+class ListRecord(Record):
+    __slots__ = (
+        "origin", "name", "auth", "common", "famnum", "family", "fam_com",
+        "divnum", "group", "note", "specnum"
+    )
+
 class SearchMap(object):
     def __getitem__(self, cp):
         cp = chr(cp)
@@ -199,22 +305,53 @@ class SearchMap(object):
             return 0x20
         return None
 
-def name_matches(trie, patterns, level=0):
-    for node in trie:
-        if (level < len(patterns) and
-        not fnmatchcase(node["word"], patterns[level] + "*")):
-            continue
-        if level + 1 >= len(patterns) and "name" in node:
-            yield node["name"]
-        else:
-            for name in name_matches(node["children"], patterns, level + 1):
-                yield name
+MATCH_PAGE = 50
+
+def format_match(value, match):
+    """Shows a matching name with the punctuation typed in the entry"""
+    s = str()
+    i = 0
+    space = True
+    for word in match.split():
+        if not space:
+            s += " "
+        
+        while i < len(value):
+            c = value[i]
+            i += 1
+            if c.isalnum() or c == "_":
+                break
+            s += c
+        
+        s += word
+        
+        end = i
+        space = False
+        while i < len(value):
+            c = value[i]
+            i += 1
+            if c.isalnum() or c == "_":
+                end = i
+            elif c.isspace():
+                space = True
+                break
+        s += value[end:i]
+    
+    s += value[i:]
+    return s
+
+CPL_FIELDS = ("name", "ex", "common", "family", "fam_com", "group", "note")
 
 def convert_cpl(plant):
-    plant = plant.__dict__
+    plant = dict(plant)
     plant["origin"] = plant["ex"]
     return plant
 
+FREQ_FIELDS = (
+    "ORIGIN", "NAME", "AUTHORITY", "COMMONNAME", "FAMILYNO", "FAMILYNAME",
+    "DIVISION", "DivisionText", "SPECNUM",
+)
+
 def convert_freqs(plant):
     return dict(
         origin=plant["ORIGIN"],
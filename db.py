@@ -1,5 +1,8 @@
 import csv
 from shorthand import SimpleNamespace
+from functools import lru_cache
+from sys import intern
+from concurrent.futures import ProcessPoolExecutor
 
 abbr = dict(
     aff="aff", affin="aff",
@@ -15,69 +18,244 @@ abbr = dict(
     x="x",
 )
 
-def CaCsvReader(file):
+class Record(object):
+    """Base for records with a fixed set of fields, listed in __slots__
+    
+    Fields can be accessed as attributes or by subscripting, and are None
+    unless set.
+    """
+    
+    __slots__ = ()
+    
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.pop(name, None))
+        if fields:
+            msg = "Unexpected {} fields: {}"
+            raise TypeError(msg.format(type(self).__name__, ", ".join(fields)))
+    
+    def keys(self):
+        return self.__slots__
+    
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+    
+    def __setitem__(self, name, value):
+        try:
+            setattr(self, name, value)
+        except AttributeError:
+            raise KeyError(name)
+    
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+    
+    def __repr__(self):
+        fields = ("{}={!r}".format(name, getattr(self, name))
+            for name in self.__slots__)
+        return "{}({})".format(type(self).__name__, ", ".join(fields))
+
+class CplRecord(Record):
+    __slots__ = (
+        "name", "ex", "common", "family", "fam_com", "group", "area", "grid",
+        "note", "vrots", "weed",
+    )
+
+class FreqRecord(Record):
+    __slots__ = (
+        "EVC", "EVC_DESC", "BioregionNo", "Frequency", "NAME", "AUTHORITY",
+        "COMMONNAME", "ORIGIN", "AROTS", "VROTS", "FAMILYNO", "FAMILYNAME",
+        "DIVISION", "DivisionText", "SPECNUM",
+    )
+
+class QuadRecord(Record):
+    __slots__ = ("arots", "vrots", "origin", "name", "common", "group", "family")
+
+# The readers take optional "fields" and "filter" parameters. The fields
+# parameter is a collection of the field names to read; other fields are
+# left as None. The filter parameter is a function called with each record,
+# which only has the selected fields read. Records are only produced if the
+# filter returns true.
+
+def record_columns(Record, headings, fields=None):
+    """Returns ((column, field), ...) for each heading that is a field"""
+    if fields is None:
+        fields = Record.__slots__
+    return tuple((col, field) for [col, field] in enumerate(headings)
+        if field in Record.__slots__ and field in fields)
+
+def project(names, fields=None):
+    """Replaces any names that are not in fields with None"""
+    if fields is None:
+        return names
+    return tuple(name if name in fields else None for name in names)
+
+def CaCsvReader(file, fields=None, filter=None):
     with open(file, newline="") as file:
-        for plant in csv.reader(file):
-            if plant[0].startswith("\x1A"):
-                break
-            yield tuple_record(plant, (
-                "name", "ex", "common", "family", "fam_com", "group", "area", "grid", "note",
-            ), empty=("ex", "area", "note"))
+        yield from ca_records(csv.reader(file), fields, filter)
+
+def ca_records(rows, fields=None, filter=None):
+    """Parses rows of the Castlemaine plant list, such as from a CSV file"""
+    names = project((
+        "name", "ex", "common", "family", "fam_com", "group", "area", "grid", "note",
+    ), fields)
+    for plant in rows:
+        if not plant:
+            continue
+        if plant[0].startswith("\x1A"):
+            break
+        plant = tuple_record(plant, names,
+            empty=("ex", "area", "note"), Record=CplRecord)
+        if filter is None or filter(plant):
+            yield plant
 
-def FreqCsvReader(file):
+def FreqCsvReader(file, fields=None, filter=None):
     with open(file, newline="") as file:
-        for plant in csv.DictReader(file):
+        reader = csv.reader(file)
+        columns = record_columns(FreqRecord, next(reader), fields)
+        for row in reader:
+            plant = FreqRecord()
+            for [col, field] in columns:
+                if col < len(row):
+                    plant[field] = row[col]
             convert_none_skip(plant, FREQS_EMPTIES)
-            freq_ints(plant)
-            yield plant
+            freq_ints(plant, fields)
+            if filter is None or filter(plant):
+                yield plant
 
 FREQS_EMPTIES = ("ORIGIN", "AROTS", "VROTS")
 
-def freq_ints(record):
+def freq_ints(record, fields=None):
     for field in ("EVC", "Frequency", "SPECNUM"):
-        record[field] = int(record[field])
-    record["BioregionNo"] = float(record["BioregionNo"])
+        if fields is None or field in fields:
+            record[field] = int(record[field])
+    if fields is None or "BioregionNo" in fields:
+        record["BioregionNo"] = float(record["BioregionNo"])
 
-def QuadratReader(file):
+def evc_index(freqs):
+    """Summarises the rows for each EVC in a sequence of frequency records
+    
+    Returns {EVC: SimpleNamespace(desc, ranges, count, max_freq), ...}.
+    The ranges attribute lists (start, stop) slices of the sequence, one for
+    each run of consecutive rows for the EVC. Only the EVC_INDEX_FIELDS of
+    the records are used.
+    """
+    
+    index = dict()
+    entry = None
+    last_evc = None
+    start = 0
+    for [i, plant] in enumerate(freqs):
+        evc = plant["EVC"]
+        if entry is None or evc != last_evc:
+            if entry is not None:
+                entry.ranges.append((start, i))
+            entry = index.get(evc)
+            if entry is None:
+                entry = SimpleNamespace(desc=plant.get("EVC_DESC"),
+                    ranges=list(), count=0, max_freq=plant["Frequency"])
+                index[evc] = entry
+            start = i
+            last_evc = evc
+        entry.count += 1
+        entry.max_freq = max(entry.max_freq, plant["Frequency"])
+    if entry is not None:
+        entry.ranges.append((start, i + 1))
+    return index
+
+EVC_INDEX_FIELDS = ("EVC", "EVC_DESC", "Frequency")
+
+def evc_rows(freqs, index, evcs, key="EVC"):
+    """Yields the records for the selected EVCs in their original order
+    
+    The key is either "EVC" or "EVC_DESC", and selects whether the EVCs are
+    identified by number or description.
+    """
+    
+    ranges = list()
+    for [evc, entry] in index.items():
+        if key == "EVC_DESC":
+            evc = entry.desc
+        if evc in evcs:
+            ranges.extend(entry.ranges)
+    for [start, stop] in sorted(ranges):
+        yield from freqs[start:stop]
+
+def load_sources(sources, workers=1):
+    """Calls each function in a list, in parallel processes
+    
+    Returns the results in the same order as the list. If workers is 1,
+    the functions are called one after another in this process. If it is
+    None, the number of CPUs is used.
+    """
+    
+    if workers == 1 or len(sources) < 2:
+        return list(source() for source in sources)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = list(pool.submit(source) for source in sources)
+        return list(future.result() for future in futures)
+
+def QuadratReader(file, fields=None, filter=None):
     with open(file, newline="") as file:
-        file = csv.reader(file)
-        next(file)
-        extra = SimpleNamespace()
-        for row in file:
-            if tuple(row) == ("Scientific Name", "Common Name"):
-                continue
-            if row[1] == "t1":
-                (extra.group, _, *_) = row
-                family = None
-                continue
-            elif row[1] == "t2":
-                (extra.family, _, *_) = row
-                continue
-            
-            empty = ("arots", "vrots", "origin")
-            record = tuple_record(row,
-                ("arots", "vrots", "origin", "name", "common"), empty=empty)
-            record.__dict__.update(vars(extra))
-            if not vars(extra):
-                convert_none(record.__dict__, empty)
-                
-                # Convert a single space to empty string
-                for name in empty:
-                    if getattr(record, name) == " ":
-                        setattr(record, name, "")
+        yield from quad_records(csv.reader(file), fields, filter)
+
+def quad_records(rows, fields=None, filter=None, header=True):
+    """Parses the rows of a Viridans quadrat list, such as from a CSV file
+    
+    The first row is skipped as a header, unless header is false. Rows
+    of column headings, and rows with less than two cells, such as titles,
+    are also skipped.
+    """
+    names = project(("arots", "vrots", "origin", "name", "common"), fields)
+    if fields is None:
+        fields = QuadRecord.__slots__
+    rows = iter(rows)
+    if header:
+        next(rows)
+    extra = dict()
+    for row in rows:
+        if len(row) < 2:
+            continue
+        if "Scientific Name" in row:
+            continue
+        if row[1] == "t1":
+            (extra["group"], _, *_) = row
+            family = None
+            continue
+        elif row[1] == "t2":
+            (extra["family"], _, *_) = row
+            continue
+        
+        empty = ("arots", "vrots", "origin")
+        record = tuple_record(row, names, empty=empty,
+            Record=QuadRecord)
+        for [field, value] in extra.items():
+            if field in fields:
+                record[field] = value
+        if not extra:
+            convert_none(record, empty)
             
+            # Convert a single space to empty string
+            for name in empty:
+                if getattr(record, name) == " ":
+                    setattr(record, name, "")
+        
+        if filter is None or filter(record):
             yield record
 
-def tuple_record(values, fields, empty):
-    record = SimpleNamespace()
-    record.__dict__.update(zip(fields, values))
-    convert_none_skip(record.__dict__, empty)
+def tuple_record(values, fields, empty, Record):
+    """Builds a record from a row of values, skipping fields that are None"""
+    record = Record()
+    for [field, value] in zip(fields, values):
+        if field is not None:
+            record[field] = value
+    convert_none_skip(record, empty)
     return record
 
 def convert_none_skip(record, skip):
-    # Python 3.2.3 seems to have trouble with dict_keys() - tuple(). Bug?
-    # Looks like it treats each tuple member as a separate set to subtract.
-    fields = record.keys() - iter(skip)
+    fields = tuple(field for field in record.keys() if field not in skip)
     convert_none(record, fields)
 
 def convert_none(record, fields):
@@ -85,8 +263,16 @@ def convert_none(record, fields):
         if not record[field]:
             record[field] = None
 
+@lru_cache(maxsize=0x10000)
 def plant_key(name):
-    words = name.translate(NameSimplifier()).split()
+    """Canonical sorting and matching key for a plant name
+    
+    Keys for recently seen names are cached; see plant_key.cache_info() for
+    the hit and miss counts. The words of the key are interned, and equal
+    keys from different spellings of recently seen names are shared, by
+    intern_key()."""
+    
+    words = name.translate(name_simplifier).split()
     key = list()
     
     i = 0
@@ -104,19 +290,37 @@ def plant_key(name):
         # If the element is of the form (desc desc name), put the name
         # part first in the key so that it has higher sorting priority
         try:
-            element = (words[i],) + desc
+            element = (intern(words[i]),) + desc
             i += 1
         except IndexError:
             element = ("",) + desc
         
         key.append(element)
-    return tuple(key)
-
-class NameSimplifier(object):
-    def __getitem__(self, cp):
-        cp = chr(cp)
-        if cp.isalnum():
-            return cp.lower()
-        if cp.isspace():
-            return 0x20
+    return intern_key(tuple(key))
+
+@lru_cache(maxsize=0x10000)
+def intern_key(key):
+    """Returns the first equal key seen, out of those recently seen"""
+    return key
+
+class NameSimplifier(dict):
+    """Translation table for str.translate(), filled in as code points are
+    encountered"""
+    
+    def __missing__(self, cp):
+        result = simplify_char(cp)
+        self[cp] = result
+        return result
+
+def simplify_char(cp):
+    c = chr(cp)
+    if c.isalnum():
+        return c.lower()
+    elif c.isspace():
+        return 0x20
+    else:
         return None
+
+# Compile the Latin-1 range up front
+name_simplifier = NameSimplifier(
+    (cp, simplify_char(cp)) for cp in range(0x100))
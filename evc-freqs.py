@@ -2,63 +2,115 @@
 
 from excel import FreqExcelReader
 from contextlib import ExitStack
-from sys import stderr, stdout
-from time import monotonic
+from sys import stdout
 import csv
 from io import TextIOWrapper
+from shorthand import SimpleNamespace
+from heapq import heappush, heapreplace
+from functools import partial
+from excel import (iter_progress, check_desc)
+from db import load_sources
 
-def main(freqs, per_evc):
+def main(freqs, per_evc, *, more_freqs=(), stream=False, workers=None):
+    """Lists the most frequent plants of each EVC
+    
+    more_freqs: Further files, such as one for each bioregion. The files
+    are read in parallel processes, unless workers is 1.
+    """
+    
     per_evc = float(per_evc)
-    deadline = monotonic() + 1
-    midline = False
+    if workers is not None:
+        workers = int(workers)
+    # Keep the top plants of each EVC, so the rows do not have to be sorted
+    limit = max(per_evc, 1)
+    results = load_sources(list(partial(read_evcs, file, limit, stream)
+        for file in (freqs,) + tuple(more_freqs)), workers)
+    
+    evcs = dict()  # {(BioregionNo, EVC): SimpleNamespace(...), ...}
+    for [f, file_evcs] in enumerate(results):
+        for [key, evc] in file_evcs.items():
+            # Of equal frequencies, earlier files are preferred
+            top = list((freq, -f, i, name) for [freq, i, name] in evc.top)
+            try:
+                merged = evcs[key]
+            except LookupError:
+                evc.top = top
+                evcs[key] = evc
+                continue
+            check_desc(key[1], merged, evc.desc)
+            merged.max_freq = max(merged.max_freq, evc.max_freq)
+            
+            # The same EVC from several files lists each plant once
+            best = dict()
+            for entry in merged.top + top:
+                name = entry[-1]
+                if name not in best or entry > best[name]:
+                    best[name] = entry
+            merged.top = list()
+            for entry in best.values():
+                add_top(merged.top, limit, entry)
     
     with ExitStack() as cleanup:
-        freqs = FreqExcelReader(freqs)
-        cleanup.callback(freqs.close)
-        
         out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
             newline="", line_buffering=stdout.line_buffering)
         cleanup.callback(out.detach)
         writer = csv.writer(out)
         writer.writerow(("NAME", "Frequency", "rel"))
-        
-        total = format(len(freqs))
-        last_evc = None
-        for [i, plant] in enumerate(freqs):
-            if stderr:
-                now = monotonic()
-                if now >= deadline:
-                    if midline:
-                        stderr.write("\r")
-                    msg = "Record {:{}}/{}".format(i + 1, len(total), total)
-                    stderr.write(msg)
-                    stderr.flush()
-                    midline = True
-                    deadline = now + 0.1
-            
-            freq = plant["Frequency"]
-            if plant["EVC"] != last_evc:
-                last_evc = plant["EVC"]
-                last_desc = plant["EVC_DESC"]
-                max_freq = freq
-                evc_start = i
-                writer.writerow(())
-                writer.writerow((f'{last_evc} {last_desc}',))
-            else:
-                assert freq <= max_freq
-                if plant["EVC_DESC"] != last_desc:
-                    msg = "EVC {} EVC_DESC inconsistent between {!r} and " \
-                        "{!r}".format(last_evc, last_desc, plant["EVC_DESC"])
-                    print(msg, file=stderr)
-                    last_desc = plant["EVC_DESC"]
-                if i - evc_start >= per_evc:
-                    continue
-            rel = format(freq / max_freq, '#.2g')
-            writer.writerow((plant["NAME"], freq, rel))
+        writer.writerows(format_evcs(evcs))
+
+def format_evcs(evcs):
+    """Yields the output rows, with a section for each EVC"""
+    bioregions = set(bioregion for [bioregion, _] in evcs)
+    for [[bioregion, evc_no], evc] in evcs.items():
+        yield ()
+        heading = f'{evc_no} {evc.desc}'
+        if len(bioregions) > 1:
+            heading += f' (bioregion {bioregion:g})'
+        yield (heading,)
+        for [freq, *_, name] in sorted(evc.top, reverse=True):
+            rel = format(freq / evc.max_freq, '#.2g')
+            yield (name, freq, rel)
+
+def read_evcs(file, limit, stream=False):
+    with ExitStack() as cleanup:
+        freqs = FreqExcelReader(file, FIELDS, streaming=stream)
+        cleanup.callback(freqs.close)
+        return top_evcs(iter_progress(freqs), limit)
+
+def top_evcs(freqs, limit):
+    """Returns {(BioregionNo, EVC): SimpleNamespace(...), ...}
     
-    if stderr and midline:
-        stderr.write("\x1B[1K\r")
-        stderr.flush()
+    Each EVC has its description, maximum frequency, and a min-heap of up
+    to "limit" entries of (freq, -i, name) for its most frequent plants.
+    The records can be in any order.
+    """
+    
+    evcs = dict()
+    for [i, plant] in enumerate(freqs):
+        freq = plant["Frequency"]
+        key = (plant["BioregionNo"], plant["EVC"])
+        try:
+            evc = evcs[key]
+        except LookupError:
+            evc = SimpleNamespace(desc=plant["EVC_DESC"], max_freq=freq,
+                top=list())
+            evcs[key] = evc
+        else:
+            check_desc(key[1], evc, plant["EVC_DESC"])
+            evc.max_freq = max(evc.max_freq, freq)
+        
+        # Of equal frequencies, the earliest rows are kept
+        add_top(evc.top, limit, (freq, -i, plant["NAME"]))
+    return evcs
+
+def add_top(top, limit, entry):
+    """Adds an entry to a min-heap, keeping only the largest entries"""
+    if len(top) < limit:
+        heappush(top, entry)
+    elif entry > top[0]:
+        heapreplace(top, entry)
+
+FIELDS = ("EVC", "EVC_DESC", "BioregionNo", "Frequency", "NAME")
 
 if __name__ == "__main__":
     from clifunc import run
@@ -1,13 +1,18 @@
-from shorthand import SimpleNamespace
 from xlrd import open_workbook
 from xlrd import (XL_CELL_EMPTY, XL_CELL_BLANK)
 from numbers import Number
 from contextlib import closing
 from db import FREQS_EMPTIES, freq_ints
+from db import (CplRecord, FreqRecord, record_columns)
+from db import project
 from sys import stderr
 from collections.abc import Sequence
+import biff
+from time import monotonic
+from multiprocessing import parent_process
+from copy import copy
 
-def CplExcelReader(file):
+def CplExcelReader(file, fields=None, filter=None, streaming=False):
     HEADING_FIELDS = {
         "r": "vrots",
         "w": "weed",
@@ -20,15 +25,17 @@ def CplExcelReader(file):
         "Notes": "note",
     }
     
-    with closing(excel_sheets(file)) as file:
-        for sheet in file:
+    if fields is None:
+        fields = CplRecord.__slots__
+    
+    with closing(sheet_rows(file, streaming)) as file:
+        for rows in file:
             extra = dict()
             expect_headings = False
-            for row in range(sheet.nrows):
-                types = sheet.row_types(row)
+            for values in rows:
                 group_col = None
-                for (col, type) in enumerate(types):
-                    if type in EXCEL_BLANKS:
+                for (col, value) in enumerate(values):
+                    if value is None:
                         continue
                     if group_col is None:
                         group_col = col
@@ -36,74 +43,168 @@ def CplExcelReader(file):
                         break
                 else:
                     if group_col is not None:
-                        group = sheet.cell_value(row, group_col)
-                        extra.update(group=group.strip())
+                        extra.update(group=values[group_col].strip())
                         expect_headings = True
                     continue
                 if expect_headings:
-                    fields = dict()
-                    for (col, heading) in enumerate(sheet.row_values(row)):
+                    columns = dict()
+                    for (col, heading) in enumerate(values):
                         try:
                             field = HEADING_FIELDS[heading]
                         except LookupError:
                             continue
-                        fields[field] = col
+                        columns[field] = col
+                    projected = tuple((name, col)
+                        for (name, col) in columns.items() if name in fields)
+                    fam_cols = frozenset(columns.get(field)
+                        for field in ("name", "common"))
                     expect_headings = False
                     continue
                 
-                fam_fields = ("name", "common")
-                for (col, type) in enumerate(types):
-                    if col in (fields[field] for field in fam_fields):
+                for (col, value) in enumerate(values):
+                    if col in fam_cols:
                         continue
-                    if type not in EXCEL_BLANKS:
+                    if value is not None:
                         break
                 else:
                     extra.update(
-                        family=sheet.cell_value(row, fields["name"]),
-                        fam_com=sheet.cell_value(row, fields["common"]),
+                        family=cell_value(values, columns["name"]),
+                        fam_com=cell_value(values, columns["common"]),
                     )
                     continue
                 
-                plant = SimpleNamespace(**extra)
-                for (name, col) in fields.items():
-                    value = excel_value(sheet, row, col)
+                plant = CplRecord()
+                for (name, value) in extra.items():
+                    if name in fields:
+                        setattr(plant, name, value)
+                for (name, col) in projected:
+                    value = values[col] if col < len(values) else None
                     if isinstance(value, Number):
                         # Seen area=0 recorded as a number
                         value = format(value, "g")
                     elif value is not None:
                         value = value.strip()
                     setattr(plant, name, value)
-                convert_empty(plant.__dict__,
-                    ("vrots", "weed", "ex", "area", "note"))
-                yield plant
+                convert_empty(plant, ("vrots", "weed", "ex", "area", "note"),
+                    fields)
+                if filter is None or filter(plant):
+                    yield plant
 
 class FreqExcelReader(Sequence):
-    def __init__(self, file):
-        self._book = open_workbook(file,
-            on_demand=True, ragged_rows=True, logfile=stderr)
-        with self._book:
-            self._sheet = self._book.sheet_by_index(0)
-        try:
-            self._fields = self._sheet.row_values(0)
-        except:
-            self.close()
-            raise
+    """Frequency records from the first sheet of a workbook
+    
+    The filter parameter only applies when iterating. Indexing and len()
+    cover every row. With streaming, the workbook is read a row at a time
+    by the biff module, and the records can only be iterated. Their len()
+    comes from the sheet's DIMENSIONS record, and raises TypeError if the
+    record is missing.
+    """
+    
+    def __init__(self, file, fields=None, filter=None, streaming=False):
+        self._project = fields
+        self._filter = filter
+        if streaming:
+            self._sheet = None
+            self._book = biff.Workbook(file)
+            try:
+                self._nrows = self._book.nrows(0)
+                self._fields = next(self._book.iter_rows(0), [])
+            except:
+                self.close()
+                raise
+        else:
+            self._book = open_workbook(file,
+                on_demand=True, ragged_rows=True, logfile=stderr)
+            with self._book:
+                self._sheet = self._book.sheet_by_index(0)
+            try:
+                self._nrows = self._sheet.nrows
+                self._fields = self._sheet.row_values(0)
+            except:
+                self.close()
+                raise
+        self._columns = record_columns(FreqRecord, self._fields, fields)
     
     def close(self):
-        self._book.unload_sheet(0)
+        if self._sheet is None:
+            self._book.close()
+        else:
+            self._book.unload_sheet(0)
     
     def __len__(self):
-        return self._sheet.nrows - 1
+        if self._nrows is None:
+            raise TypeError("Streamed workbook does not record its length")
+        return max(self._nrows - 1, 0)
     
     def __getitem__(self, i):
-        row = range(1, self._sheet.nrows)[i]
-        plant = dict()
-        for [col, field] in enumerate(self._fields):
-            plant[field] = excel_value(self._sheet, row, col)
-        convert_empty(plant, FREQS_EMPTIES)
-        freq_ints(plant)
+        """Returns a record, or a list of records for a slice"""
+        if self._sheet is None:
+            raise TypeError("Streamed records can only be iterated")
+        rows = range(1, self._nrows)[i]
+        if isinstance(i, slice):
+            return list(map(self._record, self._rows(rows)))
+        [values] = self._rows((rows,))
+        return self._record(values)
+    
+    def project(self, fields):
+        """Returns the same rows with only the given fields read
+        
+        The result is not filtered, so that iterating it covers the same
+        rows as indexing. It shares the open workbook, and does not need
+        closing.
+        """
+        projected = copy(self)
+        projected._project = fields
+        projected._filter = None
+        projected._columns = record_columns(FreqRecord, self._fields, fields)
+        return projected
+    
+    def __iter__(self):
+        if self._sheet is None:
+            rows = self._book.iter_rows(0)
+            next(rows, None)
+            batches = (rows,)
+        else:
+            batches = (self._rows(range(start, min(start + BATCH, self._nrows)))
+                for start in range(1, self._nrows, BATCH))
+        for batch in batches:
+            for plant in map(self._record, batch):
+                if self._filter is None or self._filter(plant):
+                    yield plant
+    
+    def _rows(self, rows):
+        return list(row_cells(self._sheet, row) for row in rows)
+    
+    def _record(self, values):
+        plant = FreqRecord()
+        for [col, field] in self._columns:
+            if col < len(values):
+                setattr(plant, field, values[col])
+        convert_empty(plant, FREQS_EMPTIES, self._project)
+        freq_ints(plant, self._project)
         return plant
 
+BATCH = 1000
+
+def sheet_rows(file, streaming=False):
+    """Yields an iterator over the rows of each worksheet
+    
+    Each row is a list of values, with None for blank cells. With
+    streaming, the workbook is read by the biff module instead of xlrd.
+    """
+    
+    if streaming:
+        book = biff.Workbook(file)
+        try:
+            for i in range(book.nsheets):
+                yield book.iter_rows(i)
+        finally:
+            book.close()
+    else:
+        with closing(excel_sheets(file)) as sheets:
+            for sheet in sheets:
+                yield (row_cells(sheet, row) for row in range(sheet.nrows))
+
 def excel_sheets(*args, **kw):
     book = open_workbook(*args,
         on_demand=True, ragged_rows=True, logfile=stderr, **kw)
@@ -114,18 +215,74 @@ def excel_sheets(*args, **kw):
             finally:
                 book.unload_sheet(i)
 
-def excel_value(sheet, row, col):
-    try:
-        cell = sheet.cell(row, col)
-    except LookupError:
-        return None
-    if cell.ctype in EXCEL_BLANKS:
-        return None
-    return cell.value
+def row_cells(sheet, row, types=None):
+    """Returns a list of the values in a row, with None for blank cells"""
+    values = sheet.row_values(row)
+    if types is None:
+        types = sheet.row_types(row)
+    for (col, type) in enumerate(types):
+        if type in EXCEL_BLANKS:
+            values[col] = None
+    return values
+
+def cell_value(values, col):
+    """Returns a value from a row list, with an empty string for blanks"""
+    if col < len(values) and values[col] is not None:
+        return values[col]
+    return ""
 
 EXCEL_BLANKS = (XL_CELL_EMPTY, XL_CELL_BLANK)
 
-def convert_empty(record, fields):
-    for name in fields:
-        if record[name] is None:
+def iter_progress(records):
+    """Yields from a sequence of records, showing the count on stderr
+    
+    Nothing is shown in worker processes, which may be reading several
+    files at once. The total is only shown if the records have a length.
+    """
+    
+    if not stderr or parent_process() is not None:
+        yield from records
+        return
+    
+    deadline = monotonic() + 1
+    midline = False
+    try:
+        total = format(len(records))
+    except TypeError:
+        total = None
+    try:
+        for [i, record] in enumerate(records):
+            now = monotonic()
+            if now >= deadline:
+                if midline:
+                    stderr.write("\r")
+                if total is None:
+                    msg = "Record {}".format(i + 1)
+                else:
+                    msg = "Record {:{}}/{}".format(i + 1, len(total), total)
+                stderr.write(msg)
+                stderr.flush()
+                midline = True
+                deadline = now + 0.1
+            yield record
+    finally:
+        if midline:
+            stderr.write("\x1B[1K\r")
+            stderr.flush()
+
+def check_desc(evc, entry, desc):
+    """Reports and updates an EVC_DESC differing from entry.desc"""
+    if desc != entry.desc:
+        msg = "EVC {} EVC_DESC inconsistent between {!r} and " \
+            "{!r}".format(evc, entry.desc, desc)
+        print(msg, file=stderr)
+        entry.desc = desc
+
+def convert_empty(record, names, fields=None):
+    """Replaces None with "" for the names, if they are in fields
+    
+    Fields not read are left as None.
+    """
+    for name in project(names, fields):
+        if name is not None and record[name] is None:
             record[name] = ""
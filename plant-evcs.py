@@ -4,9 +4,12 @@ from excel import FreqExcelReader
 from contextlib import closing
 import db
 from sys import stderr, stdout
-from time import monotonic
 import csv
 from io import TextIOWrapper
+from relfreq import RelFreqs
+from shorthand import SimpleNamespace
+from functools import partial
+from excel import (iter_progress, check_desc)
 
 def lookup_tree(root, key):
     for [i, subkey] in enumerate(key):
@@ -91,9 +94,16 @@ def parse_synonyms(filename, tree):
                         msg = "{} equivalent already listed".format(plant)
                         print(msg, file=stderr)
 
-def main(freqs, selection=None, *, synonyms=None):
-    deadline = monotonic() + 1
-    midline = False
+def main(freqs, selection=None, *, more_freqs=(), synonyms=None,
+stream=False, workers=None):
+    """Tabulates the relative frequencies of plants in each EVC
+    
+    more_freqs: Further files, such as one for each bioregion. The files
+    are read in parallel processes, unless workers is 1.
+    """
+    
+    if workers is not None:
+        workers = int(workers)
     
     tree = dict()  # {subname: ..., ...}
     if selection:
@@ -147,74 +157,55 @@ def main(freqs, selection=None, *, synonyms=None):
                         print(msg, file=stderr)
     
     parse_synonyms(synonyms, tree)
-    selected = set()
-    evcs = list()  # [(evc, desc, {name: freq for each plant}) for each EVC]
-    max_freqs = list()  # [max(freq) for each EVC]
-    with closing(FreqExcelReader(freqs)) as freqs:
-        total = format(len(freqs))
-        last_evc = None
-        for [i, plant] in enumerate(freqs):
-            if stderr:
-                now = monotonic()
-                if now >= deadline:
-                    if midline:
-                        stderr.write("\r")
-                    msg = "Record {:{}}/{}".format(i + 1, len(total), total)
-                    stderr.write(msg)
-                    stderr.flush()
-                    midline = True
-                    deadline = now + 0.1
-            
-            if plant["EVC"] != last_evc:
-                last_evc = plant["EVC"]
-                last_desc = plant["EVC_DESC"]
-                plant_freqs = dict()
-                evcs.append((last_evc, last_desc, plant_freqs))
-                max_freqs.append(plant["Frequency"])
-            else:
-                max_freqs[-1] = max(max_freqs[-1], plant["Frequency"])
-                if plant["EVC_DESC"] != last_desc:
-                    msg = "EVC {} EVC_DESC inconsistent between {!r} and " \
-                        "{!r}".format(last_evc, last_desc, plant["EVC_DESC"])
-                    print(msg, file=stderr)
-                    last_desc = plant["EVC_DESC"]
-            name = plant["NAME"]
-            if selection:
-                key = list(n[0] for n in db.plant_key(name))
-                if not key[-1]:
-                    key.pop()
-                [children, remainder] = lookup_tree(tree, key)
-                if remainder and children:
-                    continue
-            selected.add(name)
-            if name in plant_freqs:
-                msg = "Duplicate record for {NAME} in {EVC}"
-                print(msg.format_map(plant), file=stderr)
-            plant_freqs[name] = plant_freqs.get(name, 0) + plant["Frequency"]
+    read = partial(read_evcs, tree=tree if selection else None,
+        stream=stream)
+    results = db.load_sources(list(partial(read, file)
+        for file in (freqs,) + tuple(more_freqs)), workers)
     
-    if stderr and midline:
-        stderr.write("\x1B[1K\r")
-        stderr.flush()
+    evcs = dict()  # {(BioregionNo, EVC): SimpleNamespace(...), ...}
+    for file_evcs in results:
+        for [key, evc] in file_evcs.items():
+            try:
+                merged = evcs[key]
+            except LookupError:
+                evcs[key] = evc
+                continue
+            check_desc(key[1], merged, evc.desc)
+            merged.max_freq = max(merged.max_freq, evc.max_freq)
+            for [name, freq] in evc.freqs.items():
+                add_freq(key, merged.freqs, name, freq)
+    selected = set()
+    for evc in evcs.values():
+        selected.update(evc.freqs)
     
     out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
         newline="", line_buffering=stdout.line_buffering)
     try:
         writer = csv.writer(out)
-        writer.writerow(("EVC", "EVC_DESC", "max(Frequency)"))
-        for [[evc, desc, _], max_freq] in zip(evcs, max_freqs):
-            writer.writerow((evc, desc, max_freq))
+        bioregions = set(bioregion for [bioregion, _] in evcs)
+        if len(bioregions) > 1:
+            writer.writerow(
+                ("BioregionNo", "EVC", "EVC_DESC", "max(Frequency)"))
+            for [[bioregion, evc], entry] in evcs.items():
+                writer.writerow((format(bioregion, "g"), evc, entry.desc,
+                    entry.max_freq))
+            headings = tuple(f"{evc} (bioregion {bioregion:g})"
+                for [bioregion, evc] in evcs)
+        else:
+            writer.writerow(("EVC", "EVC_DESC", "max(Frequency)"))
+            for [[_, evc], entry] in evcs.items():
+                writer.writerow((evc, entry.desc, entry.max_freq))
+            headings = tuple(evc for [_, evc] in evcs)
         
-        writer.writerow(("NAME",) + tuple(evc for [evc, _, _] in evcs))
-        for plant in sorted(selected, key=db.plant_key):
-            row = [plant]
-            for [[_, _, freqs], max_freq] in zip(evcs, max_freqs):
-                freq = freqs.get(plant)
-                if freq is None:
-                    row.append(None)
-                    continue
-                found = True
-                row.append(format(freq / max_freq, ".2f"))
-            writer.writerow(row)
+        writer.writerow(("NAME",) + headings)
+        selected = sorted(selected, key=db.plant_key)
+        rel_freqs = RelFreqs(
+            list(list(entry.freqs.get(plant) for entry in evcs.values())
+                for plant in selected),
+            list(entry.max_freq for entry in evcs.values()),
+        )
+        for [plant, rel] in zip(selected, rel_freqs.format(".2f")):
+            writer.writerow([plant] + rel)
             
             if selection:
                 # Prune any non-branching paths leading to this entry
@@ -240,6 +231,46 @@ def main(freqs, selection=None, *, synonyms=None):
             msg = "No records matching {}"
             print(msg.format(" ".join(path).capitalize()), file=stderr)
 
+def read_evcs(file, tree=None, stream=False):
+    """Returns {(BioregionNo, EVC): SimpleNamespace(...), ...} for a file
+    
+    Each EVC has its description, maximum frequency, and the frequencies
+    of the plants selected by the tree, {name: freq, ...}. If the tree is
+    None, all plants are included.
+    """
+    
+    evcs = dict()
+    with closing(FreqExcelReader(file, FIELDS, streaming=stream)) as freqs:
+        for plant in iter_progress(freqs):
+            key = (plant["BioregionNo"], plant["EVC"])
+            try:
+                evc = evcs[key]
+            except LookupError:
+                evc = SimpleNamespace(desc=plant["EVC_DESC"],
+                    max_freq=plant["Frequency"], freqs=dict())
+                evcs[key] = evc
+            else:
+                evc.max_freq = max(evc.max_freq, plant["Frequency"])
+                check_desc(key[1], evc, plant["EVC_DESC"])
+            name = plant["NAME"]
+            if tree is not None:
+                subkey = list(n[0] for n in db.plant_key(name))
+                if not subkey[-1]:
+                    subkey.pop()
+                [children, remainder] = lookup_tree(tree, subkey)
+                if remainder and children:
+                    continue
+            add_freq(key, evc.freqs, name, plant["Frequency"])
+    return evcs
+
+def add_freq(key, freqs, name, freq):
+    if name in freqs:
+        msg = "Duplicate record for {} in {}".format(name, key[1])
+        print(msg, file=stderr)
+    freqs[name] = freqs.get(name, 0) + freq
+
+FIELDS = ("EVC", "EVC_DESC", "BioregionNo", "Frequency", "NAME")
+
 if __name__ == "__main__":
     from clifunc import run
     run(main)
@@ -0,0 +1,63 @@
+#! /usr/bin/env python3
+
+import tracemalloc
+from shorthand import SimpleNamespace
+from db import (CplRecord, FreqRecord, QuadRecord)
+from reveg import Plant
+
+def main(count=100000):
+    """Compare the memory used per record by each record type"""
+    
+    count = int(count)
+    print("{:<8} {:>8} {:>8} {:>8}".format("Record", "Before", "After",
+        "Saving"))
+    for [name, Record] in (
+        ("CPL", CplRecord),
+        ("Freq", FreqRecord),
+        ("Quad", QuadRecord),
+    ):
+        fields = dict.fromkeys(Record.__slots__, "value")
+        if Record is FreqRecord:
+            before = measure(count, dict, fields)
+        else:
+            before = measure(count, SimpleNamespace, fields)
+        after = measure(count, Record, fields)
+        report(name, before, after)
+    
+    before = measure(count, DictPlant, ("name", ("key",)))
+    after = measure(count, Plant, ("name", ("key",)))
+    report("Plant", before, after)
+
+def measure(count, factory, args):
+    """Returns the average bytes allocated for each object"""
+    
+    if isinstance(args, dict):
+        create = lambda: factory(**args)
+    else:
+        create = lambda: factory(*args)
+    tracemalloc.start()
+    try:
+        objects = list(create() for _ in range(count))
+        [size, _] = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del objects
+    return size / count
+
+def report(name, before, after):
+    print("{:<8} {:8.0f} {:8.0f} {:7.0%}".format(
+        name, before, after, 1 - after / before))
+
+class DictPlant(object):
+    """Plant as it was before using __slots__"""
+    
+    def __init__(self, name, key):
+        self.ca = None
+        self.evcs = dict()
+        self.quads = dict()
+        self.name = name
+        self.key = key
+
+if __name__ == "__main__":
+    from clifunc import run
+    run(main)
@@ -0,0 +1,62 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class RelFreqs(object):
+    """Plant frequencies in EVCs, relative to the maximum for each EVC
+    
+    Rows are plants and columns are EVCs. The calculations are done on NumPy
+    arrays if NumPy is available, otherwise on lists.
+    """
+    
+    def __init__(self, freqs, max_freqs):
+        """freqs: [[frequency or None for each EVC] for each plant]
+        max_freqs: [maximum frequency or None for each EVC]
+        
+        Relative frequencies are left blank where the frequency is None or
+        the maximum is None or zero.
+        """
+        
+        if numpy is None:
+            self._rel = list(
+                list(None if freq is None or not max else freq / max
+                    for [freq, max] in zip(row, max_freqs))
+                for row in freqs)
+            return
+        
+        matrix = numpy.array(
+            list(list(numpy.nan if freq is None else freq for freq in row)
+                for row in freqs),
+            dtype=float)
+        matrix.shape = (len(freqs), len(max_freqs))
+        max_freqs = numpy.array(
+            list(max or numpy.nan for max in max_freqs),
+            dtype=float)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            self._rel = matrix / max_freqs
+    
+    def above(self, thold):
+        """Whether each plant meets the threshold in any EVC"""
+        
+        if numpy is None:
+            return list(any(rel is not None and rel >= thold for rel in row)
+                for row in self._rel)
+        with numpy.errstate(invalid="ignore"):
+            return (self._rel >= thold).any(axis=1).tolist()
+    
+    def format(self, spec):
+        """Formats each relative frequency, with empty strings for gaps
+        
+        The spec is a format() specification such as ".2f".
+        """
+        
+        if numpy is None:
+            return list(
+                list("" if rel is None else format(rel, spec) for rel in row)
+                for row in self._rel)
+        if not self._rel.size:
+            return self._rel.tolist()
+        text = numpy.char.mod("%" + spec, self._rel)
+        text[numpy.isnan(self._rel)] = ""
+        return text.tolist()
@@ -1,6 +1,6 @@
 #! /usr/bin/env python3
 
-from sys import (argv, stderr)
+from sys import (argv, stderr, stdout)
 from xml.sax import saxutils
 #~ from functools import partial
 from db import QuadratReader
@@ -9,6 +9,20 @@ import guis
 from functools import total_ordering
 from db import plant_key
 from contextlib import closing
+from cache import (Cache, open_cached)
+from cache import Records
+from contextlib import contextmanager
+from db import (evc_index, evc_rows)
+from db import EVC_INDEX_FIELDS
+from db import load_sources
+from functools import partial
+from cache import default_dir as default_cache_dir
+import csv
+import json
+from os import path
+from io import TextIOWrapper
+from relfreq import RelFreqs
+from types import MappingProxyType
 
 TITLE = "Reveg DB version 0.3.0"
 
@@ -19,9 +33,14 @@ def main():
     plants = []
     freq_thold = THOLD_DEFAULT
     ca_file = None
-    freq_file = None
+    freq_files = []
     evcs = []
     quads = []
+    cache_dir = None
+    use_cache = True
+    out = None
+    workers = None
+    stream = False
     
     i = iter(argv)
     next(i)
@@ -36,13 +55,23 @@ def main():
         elif lower == "ca":
             ca_file = next(i)
         elif lower == "freqs":
-            freq_file = next(i)
+            freq_files.append(next(i))
         elif lower == "evc":
             evcs.append(next(i))
         elif lower == "quad":
             quads.append(next(i))
         elif lower == "thold":
             freq_thold = float(next(i))
+        elif lower == "cache":
+            cache_dir = next(i)
+        elif lower == "nocache":
+            use_cache = False
+        elif lower == "out":
+            out = next(i)
+        elif lower == "workers":
+            workers = int(next(i))
+        elif lower == "stream":
+            stream = True
         else:
             raise SystemExit('''\
 Bad command line argument: {}
@@ -59,10 +88,12 @@ Ignores plants with * and + origin, and ferns, orchids and mistletoes.
 
 Options:
 ca <{CA}>
-\tCastlemaine plant list file, CSV or Excel. Produce combined list
-\tbased off this.
+\tCastlemaine plant list file, CSV, Excel or Word. Produce combined
+\tlist based off this.
 freqs <{FREQS}>
-\tEVC frequency plant list file, CSV or Excel
+\tEVC frequency plant list file, CSV or Excel. Several files may be
+\tgiven, such as one for each bioregion. Each EVC has a separate column
+\tfor each bioregion it is recorded in.
 grid <octal code>
 \tOctal (binary) mask code of 10-minute grid references to highlight.
 \tThe matching grid code(s) are indicated in the list, but this does
@@ -78,37 +109,74 @@ evc <name>
 \tInclude plants whose relative frequencies in EVC exceed threshold.
 \tIf the EVC does not exist (or is spelt wrong), the only indication is
 \tthe corresponding output column is not populated.
-quad <Viridans CSV file>
+quad <Viridans CSV or Word file>
 \tInclude plants from Viridans quadrat. The "systematic format" is
 \tprobably better than the alphabetical because some types of plants
 \tare then easily identified by the program and ignored.
 thold <threshold>
 \tEVC frequency threshold (default: {THOLD})
+cache <directory>
+\tDirectory to keep parsed copies of the source files in, so that they
+\tare only parsed again when they change (default: {CACHE})
+nocache
+\tParse all source files without using the cache
+out <file>
+\tWrite the list to a file without opening any windows. The format is
+\tchosen by the extension: HTML (.html, .htm), JSON Lines (.jsonl),
+\totherwise CSV. A single dash (-) writes CSV to stdout.
+workers <number>
+\tNumber of processes to read the source files with in parallel
+\t(default: the number of CPUs)
+stream
+\tRead Excel files a row at a time rather than loading whole
+\tworksheets, to limit memory use with large files
 help\tDisplay this help""".format(
             TITLE=TITLE, CA=CA_DEFAULT, FREQS=FREQ_DEFAULT,
-            THOLD=THOLD_DEFAULT))
+            THOLD=THOLD_DEFAULT, CACHE=default_cache_dir()))
+        return
+    
+    if use_cache:
+        cache = Cache(cache_dir)
+    else:
+        cache = None
+    
+    if out is not None:
+        selection = Selection(
+            ca_file=ca_file, grid=grid, area=area,
+            freq_files=freq_files, evcs=evcs, freq_thold=freq_thold,
+            quads=quads, cache=cache, workers=workers, stream=stream,
+        )
+        write_file(selection, out)
         return
     
     gui = guis.probe()
     with closing(gui.loop):
-        if ca_file is None and freq_file is None and not quads:
-            Ui(gui, grid=grid, area=area, evcs=evcs, freq_thold=freq_thold)
+        if ca_file is None and not freq_files and not quads:
+            Ui(gui, grid=grid, area=area, evcs=evcs, freq_thold=freq_thold,
+                cache=cache, workers=workers, stream=stream)
         else:
             join(gui,
                 ca_file=ca_file, grid=grid, area=area,
-                freq_file=freq_file, evcs=evcs, freq_thold=freq_thold,
-                quads=quads,
+                freq_files=freq_files, evcs=evcs, freq_thold=freq_thold,
+                quads=quads, cache=cache, workers=workers, stream=stream,
             )
         
         gui.loop.run_forever()
 
 class Ui(guis.Window):
-    def __init__(self, gui, grid, area, evcs, freq_thold):
+    def __init__(self, gui, grid, area, evcs, freq_thold, cache=None,
+    workers=1, stream=False):
         self.gui = gui
+        self.cache = cache
+        self.workers = workers
+        self.stream = stream
         
         self.ca_file = FileEntry(self.gui, CA_DEFAULT,
             title='Find "{CA_DEFAULT}"'.format_map(globals()),
-            types=(("Spreadsheet", ("TXT", "csv", "xls")),),
+            types=(
+                ("Spreadsheet", ("TXT", "csv", "xls")),
+                ("Word document", ("doc",)),
+            ),
         )
         
         #self.grid = StringVar(value=format(grid, "03o"))
@@ -122,7 +190,8 @@ class Ui(guis.Window):
         #self.area = StringVar(value="".join(area))
         self.area = guis.Entry("".join(area))
         
-        self.freqs = Freqs(gui, evcs=evcs, thold=freq_thold)
+        self.freqs = Freqs(gui, evcs=evcs, thold=freq_thold, cache=cache,
+            stream=stream)
         self.quads = Quads(gui)
         
         #button.grid(columnspan=4)
@@ -145,14 +214,16 @@ class Ui(guis.Window):
     def join(self):
         (evcs, evc_names) = self.freqs.get_evcs()
         (quad_files, quad_names) = self.quads.get()
+        freq_file = self.freqs.file.entry.get()
         join(self.gui, self,
             ca_file=self.ca_file.entry.get() or None,
             grid=int(self.grid.get(), 8),
             area=self.area.get(),
-            freq_file=self.freqs.file.entry.get() or None,
+            freq_files=[freq_file] if freq_file else [],
             evcs=evcs, evc_names=evc_names,
             freq_thold=float(self.freqs.thold.get()),
             quads=quad_files, quad_names=quad_names,
+            cache=self.cache, workers=self.workers, stream=self.stream,
         )
 
 def validate_grid(value):
@@ -246,7 +317,10 @@ class Quads(object):
         self.name = guis.Entry()
         self.file = FileEntry(gui,
             title="Find Viridans quadrat file",
-            types=(("CSV spreadsheet", ("CSV",)),),
+            types=(
+                ("CSV spreadsheet", ("CSV",)),
+                ("Word document", ("doc",)),
+            ),
             delete=False,
         )
         self.list = guis.List(("Name", "File"), selected=self.selected)
@@ -295,16 +369,23 @@ class Quads(object):
             names.append(name)
         return (files, names)
 
-class join(object):
-    def __init__(self, gui, parent=None, *,
+class Selection(object):
+    """Selects plants from the source files and merges their details
+    
+    Iterating yields a row for each plant in the list, as it is produced.
+    No GUI is involved. The sources are read the first time the headings
+    or rows are needed.
+    """
+    
+    def __init__(self, *,
     ca_file, grid, area,
-    freq_file, evcs, evc_names=None, freq_thold,
-    quads, quad_names=None):
-        for name in ("gui, "
-        "ca_file, grid, area, "
-        "freq_file, evcs, freq_thold, "
-        "quads").split(", "):
+    freq_files, evcs, evc_names=None, freq_thold,
+    quads, quad_names=None, cache=None, workers=1, stream=False):
+        for name in ("ca_file, grid, area, "
+        "freq_files, evcs, freq_thold, "
+        "quads, cache, workers, stream").split(", "):
             setattr(self, name, vars()[name])
+        self._plants = None
         
         if evc_names is None:
             self.evc_names = evcs
@@ -317,98 +398,70 @@ class join(object):
             self.quad_names = quads
         else:
             self.quad_names = quad_names
-        
-        headings = self.headings()
-        output = guis.List(headings)
-        
-        form = guis.Form(
-            output,
-            guis.Inline(
-                guis.Button("Save as &HTML . . .", command=self.save),
-                guis.Button("&Close", command=lambda: self.window.close()),
-            ),
-        )
-        self.window = guis.Window(self.gui, parent, title="Plant list",
-            contents=form)
-        #~ self.window.bind("<Return>", self.save)
-        
-        self.entries = list()
-        for entry in self:
-            self.entries.append(entry)
-            output.add(field or "" for field in entry)
-        
-        #~ buttons = Frame(self.window)
-        #~ buttons.grid()
-        #~ button = Button(buttons, text="Save as HTML . . .",
-            #~ command=self.save, default="active")
-        #~ button.grid(row=0, column=0)
-        #~ button.grid(row=0, column=1)
     
     def headings(self):
+        self.load()
         headings = ["name", "common", "ex", "area", "grid"]
-        headings.extend(self.evc_names)
+        headings.extend(heading for [_, heading] in self._evc_columns)
         headings.extend(self.quad_names)
         return headings
     
-    def __iter__(self):
-        # Read all likely plants from all sources
-        plants = Plants()
+    def load(self):
+        """Reads all likely plants from all sources, unless already read"""
+        if self._plants is not None:
+            return
         
+        sources = list()
         if self.ca_file is not None:
-            if self.ca_file.endswith(".xls"):
-                from excel import CplExcelReader as Reader
-            else:
-                from db import CaCsvReader as Reader
-            with closing(Reader(self.ca_file)) as file:
-                for plant in file:
-                    if (plant.ex in tuple("*+") or
-                    plant.group in ("f", "FERNS") or
-                    plant.family in ("Orchidaceae", "Loranthaceae")):
-                        continue
-                    plants[plant.name].ca = plant
-        
-        if self.freq_file is not None:
-            DIV_FERN = "2"
-            DIV_MOSS = "5"
-            FAM_MISTLETOE = "100"
-            FAM_ORCHID = "124"
-            
-            max_freq = dict()
-            
-            if self.freq_file.endswith(".xls"):
-                from excel import FreqExcelReader as Reader
-            else:
-                from db import FreqCsvReader as Reader
-            with closing(Reader(self.freq_file)) as file:
-                for plant in file:
-                    evc = plant[self.evc_key]
-                    if evc not in self.evcs:
-                        continue
-                    
-                    freq = plant["Frequency"]
-                    try:
-                        max = max_freq[evc]
-                    except LookupError:
-                        max_freq[evc] = freq
-                    else:
-                        if freq > max:
-                            max_freq[evc] = freq
-                    
-                    if (plant["ORIGIN"] == "*" or
-                    plant["DIVISION"] in (DIV_FERN, DIV_MOSS) or
-                    plant["FAMILYNO"] in (FAM_ORCHID, FAM_MISTLETOE)):
-                        continue
-                    
-                    plants[plant["NAME"]].evcs[evc] = plant
+            sources.append(partial(load_ca, self.ca_file, self.cache,
+                self.stream))
+        for freq_file in self.freq_files:
+            sources.append(partial(load_freqs, freq_file, self.cache,
+                self.evcs, self.evc_key, self.stream))
+        for quad_file in self.quads:
+            sources.append(partial(load_quad, quad_file, self.cache))
+        sources = iter(load_sources(sources, self.workers))
         
+        # Merge in a fixed order, independent of which source loaded first
+        plants = Plants()
+        if self.ca_file is not None:
+            for plant in next(sources):
+                plants[plant.name].ca = plant
+        max_freq = dict()  # {(BioregionNo, evc): max(Frequency), ...}
+        for _ in self.freq_files:
+            [file_max, selected] = next(sources)
+            for [key, freq] in file_max.items():
+                max_freq[key] = max(max_freq.get(key, freq), freq)
+            for [key, plant] in selected:
+                plants[plant["NAME"]].add_evc(key, plant)
         for quad_file in self.quads:
-            with closing(QuadratReader(quad_file)) as file:
-                for plant in file:
-                    if (plant.origin == "*" or
-                    plant.group == "6: Ferns and Fern-like Plants" or
-                    plant.family in ("Orchidaceae", "Loranthaceae")):
-                        continue
-                    plants[plant.name].quads[quad_file] = plant
+            for plant in next(sources):
+                plants[plant.name].add_quad(quad_file, plant)
+        
+        self._plants = plants
+        self._max_freq = max_freq
+        self._evc_columns = evc_columns(self.evcs, self.evc_names, max_freq)
+    
+    def __iter__(self):
+        self.load()
+        plants = self._plants
+        
+        # Evaluate relative frequencies for all plants in the EVCs at once
+        keys = list(key for [key, _] in self._evc_columns)
+        recorded = list(plant for plant in plants.values() if plant.evcs)
+        rel_freqs = RelFreqs(
+            list(
+                list(plant.evcs[key]["Frequency"] if key in plant.evcs
+                    else None for key in keys)
+                for plant in recorded),
+            list(self._max_freq.get(key) for key in keys),
+        )
+        thold_met = rel_freqs.above(self.freq_thold)
+        thold_met = set(plant.key
+            for [plant, met] in zip(recorded, thold_met) if met)
+        rel_freqs = dict(zip((plant.key for plant in recorded),
+            rel_freqs.format(".2f")))
+        no_freqs = [""] * len(keys)
         
         # For each species group in order, see if any plants match the
         # criteria. If so, output all plants in the species group in order.
@@ -420,18 +473,7 @@ class join(object):
                 a in self.area for a in plant.ca.area):
                     break
                 
-                for evc in self.evcs:
-                    try:
-                        evc_plant = plant.evcs[evc]
-                    except LookupError:
-                        continue
-                    freq = evc_plant["Frequency"] / max_freq[evc]
-                    if freq >= self.freq_thold:
-                        thold_met = True
-                        break
-                else:
-                    thold_met = False
-                if thold_met:
+                if plant.key in thold_met:
                     break
                 
                 if any(quad in plant.quads for quad in self.quads):
@@ -456,15 +498,7 @@ class join(object):
                     else:
                         grid = plant.ca.grid
                 
-                rel = list()
-                for evc in self.evcs:
-                    try:
-                        evc_plant = plant.evcs[evc]
-                    except LookupError:
-                        rel.append("")
-                    else:
-                        freq = evc_plant["Frequency"] / max_freq[evc]
-                        rel.append(format(freq, ".2f"))
+                rel = rel_freqs.get(plant.key, no_freqs)
                 
                 inquads = (quad in plant.quads for quad in self.quads)
                 
@@ -492,6 +526,48 @@ class join(object):
         
         print("""</table></body></html>""", file=file)
     
+    def write_csv(self, entries, file):
+        writer = csv.writer(file)
+        writer.writerow(self.headings())
+        writer.writerows(entries)
+    
+    def write_jsonl(self, entries, file):
+        headings = self.headings()
+        for entry in entries:
+            json.dump(dict(zip(headings, entry)), file)
+            file.write("\n")
+
+class join(Selection):
+    def __init__(self, gui, parent=None, **kw):
+        Selection.__init__(self, **kw)
+        self.gui = gui
+        
+        headings = self.headings()
+        output = guis.List(headings)
+        
+        form = guis.Form(
+            output,
+            guis.Inline(
+                guis.Button("Save as &HTML . . .", command=self.save),
+                guis.Button("&Close", command=lambda: self.window.close()),
+            ),
+        )
+        self.window = guis.Window(self.gui, parent, title="Plant list",
+            contents=form)
+        #~ self.window.bind("<Return>", self.save)
+        
+        self.entries = list()
+        for entry in self:
+            self.entries.append(entry)
+            output.add(field or "" for field in entry)
+        
+        #~ buttons = Frame(self.window)
+        #~ buttons.grid()
+        #~ button = Button(buttons, text="Save as HTML . . .",
+            #~ command=self.save, default="active")
+        #~ button.grid(row=0, column=0)
+        #~ button.grid(row=0, column=1)
+    
     def save(self):
         file = self.gui.file_browse("save", self.window,
             title="Save as HTML",
@@ -502,6 +578,131 @@ class join(object):
         with open(file, "w", encoding="UTF-8") as file:
             self.write_html(self.entries, file)
 
+def load_ca(file, cache=None, stream=False):
+    if file.endswith(".xls"):
+        from excel import CplExcelReader as Reader
+        options = dict(streaming=stream)
+    elif file.endswith(".doc"):
+        from word import CaWordReader as Reader
+        options = dict()
+    else:
+        from db import CaCsvReader as Reader
+        options = dict()
+    with open_cached(cache, Reader, file, CA_FIELDS, ca_wanted,
+    **options) as file:
+        return list(file)
+
+CA_FIELDS = ("name", "ex", "common", "family", "group", "area", "grid")
+
+def ca_wanted(plant):
+    return not (plant.ex in tuple("*+") or
+        plant.group in ("f", "FERNS") or
+        plant.family in ("Orchidaceae", "Loranthaceae"))
+
+def load_freqs(file, cache, evcs, evc_key, stream=False):
+    """Returns ({(BioregionNo, evc): max(Frequency), ...},
+    [((BioregionNo, evc), plant), ...])"""
+    
+    DIV_FERN = "2"
+    DIV_MOSS = "5"
+    FAM_MISTLETOE = "100"
+    FAM_ORCHID = "124"
+    
+    max_freq = dict()
+    plants = list()
+    filter = partial(evc_wanted, evcs, evc_key)
+    with open_freqs(file, cache, filter, stream) as [file, index]:
+        if index is not None:
+            file = evc_rows(file, index, evcs, evc_key)
+        for plant in file:
+            evc = plant[evc_key]
+            if evc not in evcs:
+                continue
+            
+            key = (plant["BioregionNo"], evc)
+            freq = plant["Frequency"]
+            try:
+                max = max_freq[key]
+            except LookupError:
+                max_freq[key] = freq
+            else:
+                if freq > max:
+                    max_freq[key] = freq
+            
+            if (plant["ORIGIN"] == "*" or
+            plant["DIVISION"] in (DIV_FERN, DIV_MOSS) or
+            plant["FAMILYNO"] in (FAM_ORCHID, FAM_MISTLETOE)):
+                continue
+            
+            plants.append((key, plant))
+    return (max_freq, plants)
+
+# Includes EVC_DESC and Frequency for db.evc_index()
+FREQ_FIELDS = (
+    "EVC", "EVC_DESC", "BioregionNo", "Frequency", "NAME", "ORIGIN",
+    "DIVISION", "FAMILYNO",
+)
+
+def evc_columns(evcs, names, max_freq):
+    """Returns [((BioregionNo, evc), heading), ...] for the selected EVCs
+    
+    An EVC gets a column for each bioregion it is recorded in. The headings
+    only include the bioregion if there is more than one.
+    """
+    
+    bioregions = sorted(set(bioregion for [bioregion, _] in max_freq))
+    columns = list()
+    for [evc, name] in zip(evcs, names):
+        found = list(bioregion for bioregion in bioregions
+            if (bioregion, evc) in max_freq)
+        if len(bioregions) > 1 and found:
+            for bioregion in found:
+                heading = "{} (bioregion {:g})".format(name, bioregion)
+                columns.append(((bioregion, evc), heading))
+        else:
+            columns.append(((next(iter(found), None), evc), name))
+    return columns
+
+def evc_wanted(evcs, evc_key, plant):
+    return plant[evc_key] in evcs
+
+def load_quad(file, cache=None):
+    if file.endswith(".doc"):
+        from word import QuadratWordReader as Reader
+    else:
+        Reader = QuadratReader
+    with open_cached(cache, Reader, file, QUAD_FIELDS, quad_wanted) as file:
+        return list(file)
+
+QUAD_FIELDS = ("origin", "name", "group", "family")
+
+def quad_wanted(plant):
+    return not (plant.origin == "*" or
+        plant.group == "6: Ferns and Fern-like Plants" or
+        plant.family in ("Orchidaceae", "Loranthaceae"))
+
+def write_file(selection, filename):
+    """Streams the rows of a selection to a file, formatted by its extension"""
+    
+    ext = path.splitext(filename)[1].lower()
+    if ext in (".html", ".htm"):
+        write = selection.write_html
+    elif ext == ".jsonl":
+        write = selection.write_jsonl
+    else:
+        write = selection.write_csv
+    
+    if filename == "-":
+        out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
+            newline="", line_buffering=stdout.line_buffering)
+        try:
+            selection.write_csv(selection, out)
+        finally:
+            out.detach()
+    else:
+        with open(filename, "w", encoding="UTF-8", newline="") as file:
+            write(selection, file)
+
 class Plants(dict):
     """Indexes plants by canonical name, and groups them by species"""
     
@@ -532,19 +733,34 @@ class Plants(dict):
 
 @total_ordering
 class Plant(object):
+    __slots__ = ("ca", "evcs", "quads", "name", "key")
+    
     def __init__(self, name, key):
         self.ca = None
-        self.evcs = dict()
-        self.quads = dict()
+        self.evcs = NO_RECORDS
+        self.quads = NO_RECORDS
         self.name = name
         self.key = key
     
+    def add_evc(self, evc, record):
+        if self.evcs is NO_RECORDS:
+            self.evcs = dict()
+        self.evcs[evc] = record
+    
+    def add_quad(self, quad, record):
+        if self.quads is NO_RECORDS:
+            self.quads = dict()
+        self.quads[quad] = record
+    
     def __eq__(self, other):
         return self.key == other.key
     
     def __lt__(self, other):
         return self.key < other.key
 
+# Shared by plants without any EVC or quadrat records
+NO_RECORDS = MappingProxyType(dict())
+
 def print_tagged(tag, list, file):
     for text in list:
         text = saxutils.escape(text or "")
@@ -553,7 +769,9 @@ def print_tagged(tag, list, file):
 EVC_KEYS = ("EVC_DESC", "EVC")
 
 class Freqs(object):
-    def __init__(self, gui, evcs, thold):
+    def __init__(self, gui, evcs, thold, cache=None, stream=False):
+        self.cache = cache
+        self.stream = stream
         self.file = FileEntry(gui, FREQ_DEFAULT,
             title='Find "{FREQ_DEFAULT}"'.format_map(globals()),
             types=(("Spreadsheet", ("csv", "xls")),),
@@ -586,13 +804,14 @@ class Freqs(object):
         if not file:
             return
         
-        if file.endswith(".xls"):
-            from excel import FreqExcelReader as Reader
-        else:
-            from db import FreqCsvReader as Reader
-        with closing(Reader(file)) as file:
-            evcs = set(tuple(row[key] for key in EVC_KEYS)
-                for row in file)
+        records = open_freqs(file, self.cache, stream=self.stream)
+        with records as [file, index]:
+            if index is None:
+                evcs = set(tuple(row[key] for key in EVC_KEYS)
+                    for row in file)
+            else:
+                evcs = set((entry.desc, number)
+                    for [number, entry] in index.items())
         
         saved_evcs = self.saved_evcs
         for (name, number) in sorted(evcs):
@@ -640,6 +859,46 @@ class Freqs(object):
         
         return 0 <= value <= 1
 
+@contextmanager
+def open_freqs(file, cache=None, filter=None, stream=False):
+    """Context manager giving (records, index) for an EVC frequency file
+    
+    Unless the records are only iterated, they are a sequence and the index
+    is from db.evc_index(). With a cache, the index is persisted with the
+    records. Otherwise it is built by reading only the indexed fields of a
+    workbook. Records that are only iterated are those accepted by the
+    filter, and the index is None.
+    """
+    
+    if file.endswith(".xls"):
+        from excel import FreqExcelReader as Reader
+        options = dict(streaming=stream)
+        indexable = not stream
+    else:
+        from db import FreqCsvReader as Reader
+        options = dict()
+        indexable = False
+    if cache is None:
+        with closing(Reader(file,
+        fields=FREQ_FIELDS, filter=filter, **options)) as records:
+            if indexable:
+                index = evc_index(records.project(EVC_INDEX_FIELDS))
+            else:
+                index = None
+            yield (records, index)
+    else:
+        name = "{}.{}[evc_index]"
+        name = name.format(Reader.__module__, Reader.__qualname__)
+        read = partial(read_indexed, Reader, file, **options)
+        [records, index] = cache.load(file, name, read)
+        yield (records, index)
+
+def read_indexed(Reader, file, **options):
+    """Returns (cache.Records, db.evc_index()) for a frequency file"""
+    with closing(Reader(file, fields=FREQ_FIELDS, **options)) as reader:
+        records = list(reader)
+    return (Records(records), evc_index(records))
+
 class FileEntry(object):
     def __init__(self, gui, default=None, *,
     types, title=None, command=None, delete=True):
@@ -0,0 +1,181 @@
+from bisect import bisect_left, bisect_right
+from fnmatch import fnmatchcase
+from itertools import islice
+from db import name_simplifier
+from array import array
+from collections import Counter
+from time import monotonic
+from heapq import nlargest
+
+class NameIndex(object):
+    """Word prefix search over plant names
+    
+    Each level of the tree has its words sorted, so the children matching
+    a prefix are found by bisection. Only patterns with wildcards scan the
+    words within the range of their literal prefix. The user types a
+    wildcard as an underscore (_), which db-select.py translates to the
+    asterisk (*) that the patterns here use.
+    """
+    
+    def __init__(self, names=()):
+        self.root = Node()
+        tree = dict()
+        for name in names:
+            level = tree
+            words = name.translate(name_simplifier).split()
+            if not words:
+                continue
+            for word in words[:-1]:
+                level = level.setdefault(word, [None, dict()])[1]
+            level.setdefault(words[-1], [None, dict()])[0] = name
+        compile_node(self.root, tree)
+    
+    def matches(self, patterns):
+        """Yields names whose words start with each pattern in turn
+        
+        Once all the patterns are used, only the shortest names are
+        included, not the longer names extending them.
+        """
+        return search_node(self.root, patterns, 0)
+
+class Node(object):
+    __slots__ = ("words", "children", "name")
+    
+    def __init__(self, name=None):
+        self.words = list()
+        self.children = list()
+        self.name = name
+    
+    def match_range(self, pattern):
+        """Indexes of the child words starting with a pattern"""
+        prefix = pattern.split("*", 1)[0]
+        start = bisect_left(self.words, prefix)
+        stop = bisect_right(self.words, prefix + "\U0010FFFF", start)
+        if prefix == pattern:
+            return range(start, stop)
+        pattern += "*"
+        return (i for i in range(start, stop)
+            if fnmatchcase(self.words[i], pattern))
+
+def compile_node(node, tree):
+    for word in sorted(tree):
+        [name, children] = tree[word]
+        child = Node(name)
+        compile_node(child, children)
+        node.words.append(word)
+        node.children.append(child)
+
+def search_node(node, patterns, level):
+    if level < len(patterns):
+        indexes = node.match_range(patterns[level])
+    else:
+        indexes = range(len(node.children))
+    for i in indexes:
+        child = node.children[i]
+        if level + 1 >= len(patterns) and child.name is not None:
+            yield child.name
+        else:
+            yield from search_node(child, patterns, level + 1)
+
+class Matches(object):
+    """Names matching a list of patterns, produced on demand
+    
+    If the patterns only extend those of the previous Matches object, its
+    results are narrowed down rather than searching again. The previous
+    object should not be used afterwards.
+    """
+    
+    def __init__(self, index, patterns, previous=None):
+        self.patterns = patterns
+        if previous is not None and extends(patterns, previous.patterns):
+            self.names = list(filter(self._match, previous.names))
+            self._pending = filter(self._match, previous._pending)
+        else:
+            self.names = list()
+            self._pending = index.matches(patterns)
+    
+    def get(self, stop):
+        """Returns up to the first "stop" names"""
+        if len(self.names) < stop:
+            self.names.extend(islice(self._pending, stop - len(self.names)))
+        return self.names[:stop]
+    
+    def _match(self, name):
+        words = name.translate(name_simplifier).split()
+        return all(fnmatchcase(word, pattern + "*")
+            for [word, pattern] in zip(words, self.patterns))
+
+FUZZY_TIME = 0.05
+MIN_SIMILARITY = 0.2
+
+class FuzzyIndex(object):
+    """Approximate search by the trigrams (three-character sequences) of
+    words, tolerating misspellings
+    
+    Each entry is a name, with the texts to match it by, such as the name
+    itself and its common and family names. An entry is ranked by the
+    similarity of its closest text to the query.
+    """
+    
+    def __init__(self, entries=()):
+        self.names = list()
+        self._entries = array("L")  # Entry number for each text
+        self._sizes = array("L")  # Number of trigrams in each text
+        self._postings = dict()  # {trigram: array(text numbers), ...}
+        for [name, texts] in entries:
+            entry = len(self.names)
+            self.names.append(name)
+            for text in texts:
+                grams = trigrams(text)
+                if not grams:
+                    continue
+                t = len(self._entries)
+                self._entries.append(entry)
+                self._sizes.append(len(grams))
+                for gram in grams:
+                    self._postings.setdefault(gram, array("L")).append(t)
+    
+    def matches(self, query, limit, timeout=FUZZY_TIME):
+        """Returns up to "limit" names, most similar to the query first
+        
+        The texts sharing the query's rarest trigrams are counted first.
+        Once the timeout (in seconds) has passed, the ranking only uses
+        the trigrams counted so far.
+        """
+        
+        grams = trigrams(query)
+        deadline = monotonic() + timeout
+        postings = sorted((self._postings.get(gram, ()) for gram in grams),
+            key=len)
+        shared = Counter()  # {text: trigrams shared with the query, ...}
+        for texts in postings:
+            if monotonic() > deadline:
+                break
+            shared.update(texts)
+        
+        similarity = dict()  # {entry: similarity, ...}
+        for [text, count] in shared.items():
+            # Jaccard index of the two sets of trigrams
+            score = count / (len(grams) + self._sizes[text] - count)
+            if score < MIN_SIMILARITY:
+                continue
+            entry = self._entries[text]
+            if score > similarity.get(entry, 0):
+                similarity[entry] = score
+        ranked = nlargest(limit, similarity,
+            key=lambda entry: (similarity[entry], -entry))
+        return list(self.names[entry] for entry in ranked)
+
+def trigrams(text):
+    """Set of the trigrams of each word, padded with a space each side"""
+    grams = set()
+    for word in text.translate(name_simplifier).split():
+        word = " {} ".format(word)
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+def extends(patterns, previous):
+    """Whether every match for the patterns also matches the previous"""
+    return len(patterns) == len(previous) and all(
+        pattern.startswith(prev)
+        for [pattern, prev] in zip(patterns, previous))
@@ -4,9 +4,20 @@ import sys
 import unittest
 from functions import decorator
 import reveg
+from search import NameIndex
+from search import FuzzyIndex
 from tempfile import TemporaryDirectory
 from os import path
 import csv
+from io import StringIO
+from functools import partial
+from io import (TextIOWrapper, BytesIO)
+import json
+import gc
+import os
+import biff
+from contextlib import closing
+from importlib.util import (spec_from_file_location, module_from_spec)
 
 @decorator
 def testfunc(func, base=unittest.TestCase):
@@ -25,6 +36,15 @@ def punct(self):
             "1.00"],
     ))
 
+@testfunc()
+def shared_keys(self):
+    """Different spellings of a name share one key object"""
+    
+    from db import plant_key
+    key = plant_key("Acacia lanigera var. whanii")
+    self.assertIs(plant_key("Acacia lanigera v whanii"), key)
+    self.assertIs(plant_key("ACACIA  lanigera var whanii"), key)
+
 @testfunc()
 def species(self):
     """Include all entries for matching species"""
@@ -73,7 +93,736 @@ def order(self):
         ["Typha domingensis", "Dummy common", "", "A", None, ""],
     ))
 
-def run_join(cpl=(), freqs=()):
+@testfunc()
+def headless(self):
+    """Stream the list as CSV without a GUI"""
+    
+    output = run_join(
+        cpl=(("Acacia lanigera var. whanii", "A"),),
+        freqs=(("Acacia lanigera v whanii", 100),),
+        write="write_csv",
+    )
+    self.assertEqual(output.splitlines(), [
+        "name,common,ex,area,grid,EVC",
+        "Acacia lanigera var. whanii,Dummy common,,A,,1.00",
+    ])
+
+@testfunc()
+def parallel(self):
+    """Same list when the sources are read in parallel"""
+    
+    sources = dict(
+        cpl=(("Danthonia", "A"), ("Typha sp", "A")),
+        freqs=(("Danthonia s.l. spp.", 20), ("Typha domingensis", 100)),
+    )
+    self.assertEqual(run_join(workers=2, **sources), run_join(**sources))
+
+@testfunc()
+def bioregions(self):
+    """Separate columns for an EVC from several bioregion files"""
+    
+    output = run_join(
+        cpl=(("Danthonia", "A"),),
+        freqs=(("Danthonia s.l. spp.", 20), ("Typha domingensis", 100)),
+        bioregions=((3, (("Typha domingensis", 10), ("Juncus sp.", 40))),),
+        write="write_csv",
+    )
+    self.assertEqual(output.splitlines(), [
+        "name,common,ex,area,grid,EVC (bioregion 0),EVC (bioregion 3)",
+        "Danthonia,Dummy common,,A,,,",
+        "Danthonia s.l. spp.,,,,,0.20,",
+        "Juncus sp.,,,,,,1.00",
+        "Typha domingensis,,,,,1.00,0.25",
+    ])
+
+@testfunc()
+def field_projection(self):
+    """Readers only read the selected fields"""
+    
+    from db import (ca_records, FreqCsvReader, project)
+    
+    self.assertEqual(project(("a", "b", "c"), ("c", "a")), ("a", None, "c"))
+    self.assertEqual(project(("a", "b")), ("a", "b"))
+    
+    rows = (["Acacia a", "", "Wattle", "Mimosaceae", "", "", "A", "0"],)
+    [plant] = ca_records(rows, fields=("name", "common", "area"))
+    self.assertEqual((plant.name, plant.common, plant.area),
+        ("Acacia a", "Wattle", "A"))
+    self.assertIsNone(plant.ex)
+    self.assertIsNone(plant.family)
+    self.assertIsNone(plant.grid)
+    
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "freqs.csv")
+        with open(file, "w", newline="") as writer:
+            writer = csv.writer(writer)
+            writer.writerow(("EVC", "BioregionNo", "Frequency", "NAME",
+                "ORIGIN", "SPECNUM"))
+            writer.writerow((10, "not a number", 50, "Acacia a", "", 1))
+            writer.writerow((20, "not a number", 30, "Bursaria b", "*", 2))
+        seen = list()
+        def filter(plant):
+            seen.append((plant.EVC, plant.Frequency))
+            return plant.EVC == 20
+        reader = FreqCsvReader(file, fields=("EVC", "NAME", "ORIGIN"),
+            filter=filter)
+        [plant] = reader
+        self.assertEqual(seen, [(10, None), (20, None)])
+        self.assertEqual((plant.EVC, plant.NAME, plant.ORIGIN),
+            (20, "Bursaria b", "*"))
+        self.assertIsNone(plant.BioregionNo)
+        self.assertIsNone(plant.SPECNUM)
+
+@testfunc()
+def cache_entries(self):
+    """Cached results are rebuilt only when the file contents change"""
+    
+    import cache
+    
+    built = list()
+    def build():
+        with open(file, "rb") as reader:
+            built.append(reader.read())
+        return cache.Records(list(range(10)), chunk=3)
+    with TemporaryDirectory(prefix="reveg") as dir:
+        store = cache.Cache(path.join(dir, "cache"))
+        file = path.join(dir, "source")
+        with open(file, "wb") as writer:
+            writer.write(b"first")
+        
+        records = store.load(file, "test", build)
+        self.assertEqual(list(records), list(range(10)))
+        records = store.load(file, "test", build)
+        self.assertEqual(len(built), 1)
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[4], 4)
+        self.assertEqual(records[-1], 9)
+        self.assertEqual(records[2:8], list(range(2, 8)))
+        
+        # Touched without changing the contents
+        stat = os.stat(file)
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        store.load(file, "test", build)
+        self.assertEqual(len(built), 1)
+        
+        # Same size but different contents
+        with open(file, "wb") as writer:
+            writer.write(b"again")
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+        store.load(file, "test", build)
+        self.assertEqual(built, [b"first", b"again"])
+        
+        with open(file, "wb") as writer:
+            writer.write(b"longer")
+        store.load(file, "test", build)
+        self.assertEqual(built, [b"first", b"again", b"longer"])
+        
+        # Separate entries for each name
+        store.load(file, "other", build)
+        self.assertEqual(len(built), 4)
+        store.load(file, "test", build)
+        self.assertEqual(len(built), 4)
+
+@testfunc()
+def cache_eviction(self):
+    """The least recently used entries are removed past the size limit"""
+    
+    import cache
+    
+    with TemporaryDirectory(prefix="reveg") as dir:
+        store = cache.Cache(path.join(dir, "cache"))
+        file = path.join(dir, "source")
+        with open(file, "wb") as writer:
+            writer.write(b"source")
+        def build(name):
+            return name * 10000
+        
+        def load(name):
+            return store.load(file, name, partial(build, name))
+        def entry(name):
+            name = cache.entry_name(name, path.abspath(file))
+            return path.join(store.dir, name)
+        load("a")
+        # Allow two entries
+        store.limit = os.stat(entry("a")).st_size * 2 + 100
+        load("b")
+        os.utime(entry("a"), (1000, 1000))
+        os.utime(entry("b"), (2000, 2000))
+        self.assertEqual(load("a"), "a" * 10000)  # Now most recently used
+        load("c")
+        self.assertTrue(path.exists(entry("a")))
+        self.assertFalse(path.exists(entry("b")))
+        self.assertTrue(path.exists(entry("c")))
+        
+        # The new entry is kept even if it alone is over the limit
+        store.limit = 1
+        load("d")
+        self.assertEqual(os.listdir(store.dir), [path.basename(entry("d"))])
+
+@testfunc()
+def empty_rows(self):
+    """Empty rows in the plant list are skipped"""
+    
+    from db import ca_records
+    rows = (
+        ["Acacia a", "", "Wattle", "Mimosaceae"],
+        [],
+        ["Bursaria b", "*", "Box", "Pittosporaceae"],
+        ["\x1A"],
+        ["Ignored"],
+    )
+    plants = list(ca_records(rows, fields=("name", "ex")))
+    self.assertEqual(list(plant.name for plant in plants),
+        ["Acacia a", "Bursaria b"])
+    self.assertEqual(list(plant.ex for plant in plants), ["", "*"])
+
+@testfunc()
+def relative_freqs(self):
+    """Both RelFreqs implementations leave gaps for zero maximums"""
+    
+    import relfreq
+    freqs = ((5, 3, None, 4), (0, None, 2, 0))
+    max_freqs = (10, 0, None, 0)
+    numpy = relfreq.numpy
+    try:
+        # Without NumPy installed, the fallback is tested twice
+        for relfreq.numpy in (numpy, None):
+            rel = relfreq.RelFreqs(freqs, max_freqs)
+            self.assertEqual(rel.format(".2f"),
+                [["0.50", "", "", ""], ["0.00", "", "", ""]])
+            self.assertEqual(rel.above(0.4), [True, False])
+    finally:
+        relfreq.numpy = numpy
+
+@testfunc()
+def search(self):
+    """Prefix and wildcard search of plant names"""
+    
+    index = NameIndex((
+        "Acacia", "Acacia dealbata", "Acacia decurrens",
+        "Eucalyptus camaldulensis", "Eucalyptus dealbata",
+    ))
+    self.assertEqual(list(index.matches(["acacia"])), ["Acacia"])
+    self.assertEqual(list(index.matches(["ac", "de"])),
+        ["Acacia dealbata", "Acacia decurrens"])
+    self.assertEqual(list(index.matches(["*", "d*lb"])),
+        ["Acacia dealbata", "Eucalyptus dealbata"])
+
+@testfunc()
+def search_narrowing(self):
+    """Extending the search patterns narrows the previous matches"""
+    
+    from search import (Matches, extends)
+    
+    self.assertTrue(extends(["aca", "de"], ["ac", "d"]))
+    self.assertTrue(extends(["ac"], ["ac"]))
+    self.assertFalse(extends(["ac", "d"], ["ac"]))
+    self.assertFalse(extends(["a"], ["ac"]))
+    self.assertFalse(extends(["eu"], ["ac"]))
+    
+    class Index(NameIndex):
+        searches = 0
+        def matches(self, patterns):
+            self.searches += 1
+            return NameIndex.matches(self, patterns)
+    index = Index((
+        "Acacia", "Acacia dealbata", "Acacia decurrens", "Acacia mearnsii",
+        "Eucalyptus dealbata",
+    ))
+    
+    matches = Matches(index, ["ac", "de"])
+    self.assertEqual(matches.get(1), ["Acacia dealbata"])
+    # Narrowed from the name already found and those still pending
+    matches = Matches(index, ["aca", "dec"], matches)
+    self.assertEqual(matches.get(5), ["Acacia decurrens"])
+    self.assertEqual(index.searches, 1)
+    
+    matches = Matches(index, ["ac"], matches)
+    self.assertEqual(matches.get(5), ["Acacia"])
+    self.assertEqual(index.searches, 2)
+    matches = Matches(index, ["e", "d"], matches)
+    self.assertEqual(matches.get(5), ["Eucalyptus dealbata"])
+    self.assertEqual(index.searches, 3)
+
+@testfunc()
+def fuzzy_search(self):
+    """Approximate search of plant and common names"""
+    
+    index = FuzzyIndex((
+        ("Acacia dealbata", ("Acacia dealbata", "Silver Wattle")),
+        ("Eucalyptus camaldulensis",
+            ("Eucalyptus camaldulensis", "River Red-gum")),
+        ("Eucalyptus viminalis", ("Eucalyptus viminalis", "Manna Gum")),
+    ))
+    self.assertEqual(index.matches("acaica delbata", 5), ["Acacia dealbata"])
+    self.assertEqual(index.matches("mana gum", 5), ["Eucalyptus viminalis"])
+    self.assertEqual(index.matches("zz", 5), [])
+
+@testfunc()
+def evc_top(self):
+    """Most frequent plants of each EVC, from sorted or unsorted rows"""
+    
+    evc_freqs = load_script("evc-freqs.py")
+    rows = (
+        (10, "Woodland", "Acacia a", 50),
+        (10, "Woodland", "Bursaria b", 20),
+        (10, "Woodland", "Carex c", 20),
+        (10, "Woodland", "Dianella d", 10),
+        (20, "Forest", "Eucalyptus e", 7),
+        (20, "Forest", "Fern f", 7),
+        (20, "Forest", "Grass g", 7),
+    )
+    # Output from before the rows could be unsorted
+    expected = [
+        (), ("10 Woodland",),
+        ("Acacia a", 50, "1.0"), ("Bursaria b", 20, "0.40"),
+        (), ("20 Forest",),
+        ("Eucalyptus e", 7, "1.0"), ("Fern f", 7, "1.0"),
+    ]
+    # Equal frequencies keep the order they appear in
+    for order in (range(7), (3, 4, 1, 5, 0, 2, 6)):
+        freqs = list(dict(EVC=rows[i][0], EVC_DESC=rows[i][1],
+            BioregionNo=1.0, NAME=rows[i][2], Frequency=rows[i][3])
+            for i in order)
+        evcs = evc_freqs.top_evcs(freqs, 2)
+        self.assertEqual(list(evc_freqs.format_evcs(evcs)), expected)
+
+@testfunc()
+def evc_index(self):
+    """Rows of selected EVCs are found from runs that are not contiguous"""
+    
+    from db import (evc_index, evc_rows)
+    from cache import Records
+    
+    rows = (
+        (10, "Woodland", 5), (10, "Woodland", 9),
+        (20, "Forest", 3),
+        (10, "Woodland", 7),
+        (30, "Heath", 2), (30, "Heath", 4),
+        (20, "Forest", 8), (20, "Forest", 1),
+    )
+    freqs = list(dict(EVC=evc, EVC_DESC=desc, Frequency=freq, NAME=i)
+        for [i, [evc, desc, freq]] in enumerate(rows))
+    index = evc_index(freqs)
+    self.assertEqual(index[10].desc, "Woodland")
+    self.assertEqual(index[10].ranges, [(0, 2), (3, 4)])
+    self.assertEqual(index[20].ranges, [(2, 3), (6, 8)])
+    self.assertEqual(index[30].ranges, [(4, 6)])
+    self.assertEqual(index[10].count, 3)
+    self.assertEqual(index[20].max_freq, 8)
+    
+    for records in (freqs, Records(freqs, chunk=3)):
+        selected = evc_rows(records, index, {10, 30})
+        self.assertEqual(list(plant["NAME"] for plant in selected),
+            [0, 1, 3, 4, 5])
+        selected = evc_rows(records, index, {"Forest"}, "EVC_DESC")
+        self.assertEqual(list(plant["NAME"] for plant in selected),
+            [2, 6, 7])
+
+@testfunc()
+def freqs_workbook(self):
+    """Rows of an EVC after the first are read from a workbook"""
+    
+    try:
+        import xlwt
+    except ImportError as err:
+        self.skipTest(err)
+    
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("Frequencies")
+    rows = (
+        (10, "Woodland", "Acacia a", 50),
+        (20, "Forest", "Bursaria b", 20),
+        (10, "Woodland", "Carex c", 10),
+        (20, "Forest", "Dianella d", 30),
+    )
+    for [col, field] in enumerate(reveg.FREQ_FIELDS):
+        sheet.write(0, col, field)
+    for [i, [evc, desc, name, freq]] in enumerate(rows, 1):
+        row = dict(EVC=evc, EVC_DESC=desc, BioregionNo=1, Frequency=freq,
+            NAME=name, ORIGIN="", DIVISION="4", FAMILYNO="0")
+        for [col, field] in enumerate(reveg.FREQ_FIELDS):
+            sheet.write(i, col, row[field])
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "freqs.xls")
+        book.save(file)
+        cache = reveg.Cache(path.join(dir, "cache"))
+        for [cache, stream] in ((None, False), (None, True), (cache, False)):
+            [max_freq, plants] = reveg.load_freqs(file, cache, {20}, "EVC",
+                stream)
+            self.assertEqual(max_freq, {(1.0, 20): 30})
+            self.assertEqual(list(plant["NAME"] for [_, plant] in plants),
+                ["Bursaria b", "Dianella d"])
+        
+        # Without a DIMENSIONS record, the length is not known up front
+        from excel import (FreqExcelReader, iter_progress)
+        nrows = biff.Workbook.nrows
+        biff.Workbook.nrows = lambda book, i: None
+        try:
+            records = FreqExcelReader(file, fields=reveg.FREQ_FIELDS,
+                streaming=True)
+            with closing(records):
+                with self.assertRaises(TypeError):
+                    len(records)
+                records = list(iter_progress(records))
+        finally:
+            biff.Workbook.nrows = nrows
+        self.assertEqual(len(records), 4)
+
+@testfunc()
+def biff_rows(self):
+    """Streamed rows of a workbook match those read by xlrd"""
+    
+    try:
+        import xlwt
+        import excel
+    except ImportError as err:
+        self.skipTest(err)
+    
+    book = xlwt.Workbook(encoding="utf-8")
+    sheet = book.add_sheet("Plants")
+    numbers = (1, -5, 1.5, 0.25, 123456789.125, 2**40, 3.14159, -0.01)
+    for row in range(400):
+        sheet.write(row, 0, "Name {} {}".format(row, "x" * (row % 50)))
+        sheet.write(row, 1, numbers[row % len(numbers)] * (row + 1))
+        if not row % 7:
+            sheet.write(row, 3, "\u03A9mega {}".format(row) * 3)
+        if not row % 11:
+            sheet.write(row, 4, xlwt.Formula("B{}*2".format(row + 1)))
+    # Spans several CONTINUE records of the shared string table
+    sheet.write(400, 0, "long " * 3000)
+    book.add_sheet("Other").write(2, 2, "second")
+    
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "book.xls")
+        book.save(file)
+        expected = list()
+        with closing(excel.excel_sheets(file)) as sheets:
+            for sheet in sheets:
+                expected.append(list(excel.row_cells(sheet, row)
+                    for row in range(sheet.nrows)))
+        workbook = biff.Workbook(file)
+        try:
+            self.assertEqual(workbook.nsheets, 2)
+            self.assertEqual(workbook.sheet_name(0), "Plants")
+            self.assertEqual(workbook.nrows(0), 401)
+            for [i, rows] in enumerate(expected):
+                self.assertEqual(list(workbook.iter_rows(i)), rows)
+        finally:
+            workbook.close()
+
+@testfunc()
+def excel_fields(self):
+    """Fields not read from a workbook are left as None"""
+    
+    try:
+        import xlwt
+        from excel import FreqExcelReader
+    except ImportError as err:
+        self.skipTest(err)
+    
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("Frequencies")
+    row = dict(EVC=10, BioregionNo=1, NAME="Acacia a", ORIGIN=None,
+        Frequency=50, SPECNUM=7)
+    for [col, [field, value]] in enumerate(row.items()):
+        sheet.write(0, col, field)
+        sheet.write(1, col, value)
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "freqs.xls")
+        book.save(file)
+        with closing(FreqExcelReader(file)) as records:
+            [plant] = records
+            self.assertEqual(plant.ORIGIN, "")
+            self.assertEqual(plant.AROTS, "")
+        with closing(FreqExcelReader(file, fields=("EVC", "ORIGIN"))) \
+                as records:
+            [plant] = records
+            self.assertEqual(plant.EVC, 10)
+            self.assertEqual(plant.ORIGIN, "")
+            self.assertIsNone(plant.AROTS)
+            self.assertIsNone(plant.NAME)
+
+@testfunc()
+def compound_file(self):
+    """Streams read from compound files match those read by xlrd"""
+    
+    try:
+        import xlwt
+        from xlrd.compdoc import CompDoc
+    except ImportError as err:
+        self.skipTest(err)
+    from cfb import CompoundFile
+    
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("Plants")
+    for row in range(2000):
+        sheet.write(row, 0, "Name {}".format(row))
+        sheet.write(row, 1, row / 7)
+    with TemporaryDirectory(prefix="reveg") as dir:
+        excelfile = path.join(dir, "book.xls")
+        book.save(excelfile)
+        
+        # Small streams live in the mini stream; the large stream's
+        # sectors are allocated in reverse order
+        streams = dict(
+            Small=bytes(range(100)),
+            Empty=b"",
+            Large=bytes(range(256)) * 20,
+        )
+        builtfile = path.join(dir, "built.doc")
+        with open(builtfile, "wb") as file:
+            file.write(build_compound(streams))
+        
+        for [file, names] in ((excelfile, ("Workbook",)),
+                (builtfile, streams.keys())):
+            with open(file, "rb") as f:
+                data = f.read()
+            with closing(CompoundFile(file)) as ole:
+                self.assertEqual(ole.parsing_issues, [])
+                for name in names:
+                    expected = CompDoc(data, logfile=StringIO())
+                    expected = expected.get_named_stream(name)
+                    self.assertTrue(ole.exists(name.upper()))
+                    stream = ole.openstream(name)
+                    self.assertEqual(stream.read(), expected)
+                    stream.seek(len(expected) // 3)
+                    self.assertEqual(stream.read(50),
+                        expected[len(expected) // 3:][:50])
+                self.assertFalse(ole.exists("Missing"))
+        
+        with closing(CompoundFile(builtfile)) as ole:
+            self.assertTrue(ole.exists("Storage"))
+            with self.assertRaises(ValueError):
+                ole.openstream("Storage")
+            for name in ("Storage/Small", ["Storage", "Small"]):
+                with self.assertRaises(ValueError):
+                    ole.exists(name)
+                with self.assertRaises(ValueError):
+                    ole.openstream(name)
+
+@testfunc()
+def table_index(self):
+    """Rows read through the saved table index"""
+    
+    try:
+        import word
+    except ImportError as err:
+        self.skipTest(err)
+    
+    tables = (
+        (("a", "b"), ("cc", "d")),
+        (("e",), ("f",)),
+        (("g", "h"), ("i", "j"), ("k", "l")),
+    )
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "tables.doc")
+        with open(file, "wb") as writer:
+            writer.write(build_compound(build_word(tables)))
+        index = word.table_index(file)
+        self.assertEqual(list(map(len, index)), [2, 2, 3])
+        self.assertTrue(path.exists(file + word.INDEX_SUFFIX))
+        self.assertEqual(list(word.read_rows(file, 0)),
+            list(map(list, tables[0])))
+        self.assertEqual(list(word.read_rows(file, 2, 1, 3)),
+            [["i", "j"], ["k", "l"]])
+        self.assertEqual(list(word.read_rows(file, 1, 1)), [["f"]])
+        self.assertEqual(list(word.read_rows(file, 1, 2)), [])
+        
+        out = TextIOWrapper(BytesIO(), "utf-8")
+        [stdout, word.stdout] = [word.stdout, out]
+        try:
+            word.main(file, table="2", rows=":2")
+        finally:
+            word.stdout = stdout
+        self.assertEqual(out.buffer.getvalue(), b"g,h\r\ni,j\r\n")
+        
+        # The saved index is trusted while the document is unchanged
+        with open(file + word.INDEX_SUFFIX) as reader:
+            saved = json.load(reader)
+        saved["tables"][0] = saved["tables"][2]
+        with open(file + word.INDEX_SUFFIX, "w") as writer:
+            json.dump(saved, writer)
+        self.assertEqual(list(word.read_rows(file, 0, 2)), [["k", "l"]])
+        
+        # Rebuilt when the document changes
+        tables = tables[1:]
+        with open(file, "wb") as writer:
+            writer.write(build_compound(build_word(tables)))
+        stat = os.stat(file)
+        os.utime(file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(list(word.read_rows(file, 1, 2)), [["k", "l"]])
+        self.assertEqual(len(word.table_index(file)), 2)
+        
+        # The memory map is closed straight away, without garbage collection
+        import cfb
+        closed = list()
+        close = cfb.CompoundFile.close
+        def record_close(ole):
+            close(ole)
+            closed.append(ole._map.closed)
+        cfb.CompoundFile.close = record_close
+        gc.disable()
+        try:
+            rows = word.read_rows(file, 0)
+            next(rows)
+            rows.close()
+            list(word.iter_rows(file))
+        finally:
+            gc.enable()
+            cfb.CompoundFile.close = close
+        self.assertEqual(closed, [True, True])
+        
+        with closing(cfb.CompoundFile(file)) as ole:
+            view = ole.openstream("WordDocument").view(0, 10)
+            with self.assertRaises(BufferError):
+                ole.close()
+            del view
+
+@testfunc()
+def word_quadrat(self):
+    """Quadrat records from the tables of a Word document"""
+    
+    try:
+        from word import QuadratWordReader
+    except ImportError as err:
+        self.skipTest(err)
+    
+    tables = (
+        (("Quadrat 1",),),
+        (
+            ("", "", "", "Scientific Name", "Common Name"),
+            ("Dicotyledons", "t1"),
+            ("Asteraceae", "t2"),
+            ("", "", "", "Cassinia arcuata", "Drooping Cassinia"),
+            ("r", "", "*", "Hypochaeris radicata", "Flatweed"),
+        ),
+    )
+    with TemporaryDirectory(prefix="reveg") as dir:
+        file = path.join(dir, "quadrat.doc")
+        with open(file, "wb") as writer:
+            writer.write(build_compound(build_word(tables)))
+        plants = list(QuadratWordReader(file,
+            fields=("name", "vrots", "origin", "group", "family")))
+    self.assertEqual(list((plant.name, plant.vrots, plant.origin)
+        for plant in plants), [
+        ("Cassinia arcuata", "", ""),
+        ("Hypochaeris radicata", "", "*"),
+    ])
+    self.assertEqual(list((plant.group, plant.family) for plant in plants),
+        [("Dicotyledons", "Asteraceae")] * 2)
+    self.assertIsNone(plants[0].common)
+
+def build_word(tables):
+    """Streams of a Word 97 document with a paragraph after each table"""
+    from struct import (pack, pack_into)
+    paras = list()
+    for [i, table] in enumerate(tables):
+        for row in table:
+            paras.extend((cell + "\x07", "cell") for cell in row)
+            paras.append(("\x07", "row"))
+        paras.append(("text {}\r".format(i), None))
+    text = "".join(text for [text, _] in paras).encode("cp1252")
+    assert len(paras) <= 28 and len(text) < 512  # Fit in one page
+    
+    TEXT = 1024
+    FKP = 3  # Page of paragraph properties
+    doc = bytearray(2048)
+    pack_into("<HH2xHHBBHLBB12x", doc, 0, 0xA5EC, 0xC1, 0, 0, 0,
+        0x02, 0, 0, 0, 0)  # Using the 1Table stream
+    fib_rg = bytearray(34 * 8)
+    pack_into("<LL", fib_rg, 13 * 8, 100, 12)  # PlcBtePapx
+    pack_into("<LL", fib_rg, 33 * 8, 0, 1 + 4 + 8 + 8)  # Clx
+    doc[32:32 + 6 + len(fib_rg)] = pack("<HHH", 0, 0, 34) + fib_rg
+    doc[TEXT:TEXT + len(text)] = text
+    
+    table = bytearray(512)
+    pieces = pack("<LLHLH", 0, len(text), 0, 1 << 30 | TEXT * 2, 0)
+    table[0:1 + 4 + len(pieces)] = pack("<BL", 2, len(pieces)) + pieces
+    table[100:112] = pack("<LLL", TEXT, TEXT + len(text), FKP)
+    
+    page = bytearray(512)
+    fc = TEXT
+    for [i, [para, _]] in enumerate(paras):
+        pack_into("<L", page, i * 4, fc)
+        fc += len(para)
+    pack_into("<L", page, len(paras) * 4, fc)
+    page[511] = len(paras)
+    in_table = pack("<BHHB", 3, 0, 0x2416, 1)  # sprmPFInTable
+    row_end = pack("<BBHHBHB", 0, 4, 0, 0x2416, 1, 0x2417, 1)  # sprmPFTtp
+    page[480:480 + len(in_table)] = in_table
+    page[490:490 + len(row_end)] = row_end
+    offsets = dict(cell=480 // 2, row=490 // 2)
+    for [i, [_, kind]] in enumerate(paras):
+        page[(len(paras) + 1) * 4 + i * 13] = offsets.get(kind, 0)
+    doc[FKP * 512:FKP * 512 + 512] = page
+    return {"WordDocument": bytes(doc), "1Table": bytes(table)}
+
+def build_compound(streams):
+    """Version 3 compound file with the streams and an empty storage"""
+    from struct import pack
+    SECTOR = 512
+    sectors = [None]  # First sector is the FAT
+    fat = [0xFFFFFFFD]
+    def alloc(data, reverse=False):
+        count = -(-len(data) // SECTOR)
+        ids = list(range(len(sectors), len(sectors) + count))
+        sectors.extend(None for _ in ids)
+        fat.extend(None for _ in ids)
+        if reverse:
+            ids.reverse()
+        for [i, id] in enumerate(ids):
+            block = data[i * SECTOR:][:SECTOR]
+            sectors[id] = block.ljust(SECTOR, b"\0")
+            fat[id] = ids[i + 1] if i + 1 < count else 0xFFFFFFFE
+        return ids[0] if ids else 0xFFFFFFFE
+    
+    mini = bytearray()
+    minifat = list()
+    entries = list()
+    for [name, data] in streams.items():
+        if len(data) < 4096:
+            start = len(mini) // 64 if data else 0xFFFFFFFE
+            count = -(-len(data) // 64)
+            for i in range(count):
+                last = i + 1 == count
+                minifat.append(0xFFFFFFFE if last else start + i + 1)
+            mini += data.ljust(count * 64, b"\0")
+        else:
+            start = alloc(data, reverse=True)
+        entries.append((name, 2, start, len(data)))
+    entries.append(("Storage", 1, 0, 0))
+    mini_start = alloc(bytes(mini))
+    minifat_start = alloc(pack("<{}L".format(len(minifat)), *minifat))
+    
+    def entry(name, type, right, start, size, child=0xFFFFFFFF):
+        name = (name + "\0").encode("utf-16-le")
+        return pack("<64sHBBLLL36xLQ", name, len(name), type, 1,
+            0xFFFFFFFF, right, child, start, size)
+    directory = entry("Root Entry", 5, 0xFFFFFFFF, mini_start, len(mini),
+        child=1)
+    for [i, [name, type, start, size]] in enumerate(entries, 2):
+        right = i if i <= len(entries) else 0xFFFFFFFF
+        directory += entry(name, type, right, start, size)
+    dir_start = alloc(directory)
+    
+    assert len(fat) <= SECTOR // 4
+    fat.extend(0xFFFFFFFF for _ in range(SECTOR // 4 - len(fat)))
+    sectors[0] = pack("<{}L".format(len(fat)), *fat)
+    header = pack("<8s16xHHHHH6xLLL4xLLLLL109L",
+        bytes.fromhex("D0CF11E0A1B11AE1"), 0x3E, 3, 0xFFFE, 9, 6,
+        0, 1, dir_start, 4096, minifat_start, 1, 0xFFFFFFFE, 0,
+        0, *(0xFFFFFFFF for _ in range(108)))
+    return header.ljust(SECTOR, b"\0") + b"".join(sectors)
+
+def load_script(name):
+    file = path.join(path.dirname(__file__), name)
+    spec = spec_from_file_location(name.replace("-", "_")[:-3], file)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def run_join(cpl=(), freqs=(), bioregions=(), write=None, workers=1):
     with TemporaryDirectory(prefix="reveg") as dir:
         cplfile = path.join(dir, "cpl.csv")
         with open(cplfile, "w") as file:
@@ -84,26 +833,36 @@ def run_join(cpl=(), freqs=()):
                     areas, None, "000",
                 ))
         
-        freqfile = path.join(dir, "freqs.csv")
-        with open(freqfile, "w") as file:
-            file = csv.writer(file)
-            file.writerow((
-                "EVC", "BioregionNo", "Frequency", "NAME", "ORIGIN",
-                    "FAMILYNO", "DIVISION", "SPECNUM",
-            ))
-            for row in freqs:
-                (name, freq, *row) = row
-                if row:
-                    (origin,) = row
-                else:
-                    origin = ""
-                file.writerow((10, 0, freq, name, origin, 0, 4, 0))
-        
-        join = reveg.join(TestGui(),
+        freqfiles = list()
+        for (bioregion, freqs) in ((0, freqs),) + tuple(bioregions):
+            freqfile = path.join(dir, "freqs-{}.csv".format(bioregion))
+            freqfiles.append(freqfile)
+            with open(freqfile, "w") as file:
+                file = csv.writer(file)
+                file.writerow((
+                    "EVC", "BioregionNo", "Frequency", "NAME", "ORIGIN",
+                        "FAMILYNO", "DIVISION", "SPECNUM",
+                ))
+                for row in freqs:
+                    (name, freq, *row) = row
+                    if row:
+                        (origin,) = row
+                    else:
+                        origin = ""
+                    file.writerow((10, bioregion, freq, name, origin, 0, 4, 0))
+        
+        kw = dict(
             ca_file=cplfile, grid=None, area="A",
-            freq_file=freqfile, evcs=(10,), evc_names=("EVC",), freq_thold=0.3,
-            quads=(), quad_names=(),
+            freq_files=freqfiles, evcs=(10,), evc_names=("EVC",),
+            freq_thold=0.3,
+            quads=(), quad_names=(), workers=workers,
         )
+        if write is not None:
+            selection = reveg.Selection(**kw)
+            output = StringIO()
+            getattr(selection, write)(selection, output)
+            return output.getvalue()
+        join = reveg.join(TestGui(), **kw)
         return tuple(join)
 
 class TestGui(object):
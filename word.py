@@ -1,51 +1,26 @@
 #! /usr/bin/env python3
 
-from OleFileIO_PL import OleFileIO
+from cfb import CompoundFile
 from struct import Struct
-from io import SEEK_SET, SEEK_CUR, SEEK_END
-from io import BufferedIOBase, UnsupportedOperation
+from io import SEEK_CUR
 from shorthand import bitmask
-from io import TextIOWrapper, BytesIO, StringIO
-from shutil import copyfileobj
+from contextlib import closing
+from db import (ca_records, quad_records)
+from io import TextIOWrapper
 from collections.abc import Sequence
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
 from sys import stdout, stderr
 import csv
-
-class Subfile(BufferedIOBase):
-    def readable(self):
-        return True
-    
-    def __init__(self, parent, size):
-        self._parent = parent
-        self._remaining = size
-        self._start = self._parent.tell()
-        self._offset = 0
-    
-    def read(self, size=-1):
-        if size not in range(self._remaining) or size is None:
-            size = self._remaining
-        result = self._parent.read(size)
-        self._remaining -= len(result)
-        self._offset += len(result)
-        if len(result) < size:
-            raise EOFError("Truncated read")
-        return result
-    read1 = read
-    
-    def tell(self):
-        return self._offset
-    
-    def seek(self, offset, base=SEEK_SET):
-        if base == SEEK_END:
-            offset += self._remaining
-        if base == SEEK_SET:
-            offset -= self._offset
-        if not -self._offset <= offset <= self._remaining:
-            raise EOFError("Seek out of range")
-        self._parent.seek(self._start + self._offset + offset)
-        self._remaining -= offset
-        self._offset += offset
-        return self._offset
+import json
+import os
+from os import path
+from glob import glob, escape
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+from time import monotonic
 
 unsigned2 = Struct("<H")
 signed2 = Struct("<h")
@@ -96,58 +71,74 @@ SPRA_SIZES = {0: 1, 1: 1, 2: 2, 3: 4, 4: 2, 5: 2, 7: 3}
 class Pieces(Sequence):
     def __init__(self, doc, table, fcClx, lcbClx):
         self._doc = doc
-        table.seek(fcClx)
-        self._subfile = Subfile(table, lcbClx)
+        clx = table.view(fcClx, lcbClx)
+        if len(clx) < lcbClx:
+            raise EOFError("Truncated Clx")
+        offset = 0
         while True:
-            clxt = self._subfile.read(1)
-            if clxt != b"\x01":
+            clxt = clx[offset]
+            offset += 1
+            if clxt != 0x01:
                 break
-            [cbGrpprl] = signed2.unpack(self._subfile.read(2))
+            [cbGrpprl] = signed2.unpack_from(clx, offset)
             assert cbGrpprl >= 0
-            self._subfile.seek(cbGrpprl, SEEK_CUR)
-        assert clxt == b"\x02"
-        [lcb] = unsigned4.unpack(self._subfile.read(4))
+            offset += 2 + cbGrpprl
+        assert clxt == 0x02
+        [lcb] = unsigned4.unpack_from(clx, offset)
+        offset += 4
         assert lcb >= 4
-        [self._n, remainder] = divmod(lcb - 4, 4 + Pcd.size)
+        [n, remainder] = divmod(lcb - 4, 4 + Pcd.size)
         assert not remainder
-        self._aCP = self._subfile.tell()
-        self._aPcd = self._aCP + (self._n + 1) * 4
+        
+        aCP = clx[offset:offset + (n + 1) * 4]
+        self.aCP = array("L", (cp for [cp] in unsigned4.iter_unpack(aCP)))
+        assert all(cp < next_cp
+            for [cp, next_cp] in zip(self.aCP, self.aCP[1:]))
+        offset += (n + 1) * 4
+        self._fc = array("L")
+        self._compressed = bytearray()
+        aPcd = clx[offset:offset + n * Pcd.size]
+        for [_, fc, prm] in Pcd.iter_unpack(aPcd):
+            assert prm == 0x0000
+            self._compressed.append(fc >> COMPRESSED_BIT & 1)
+            self._fc.append(fc & FC_MASK)
     
     def __len__(self):
-        return self._n
+        return len(self._fc)
     
     def __getitem__(self, i):
-        i = range(self._n)[i]
-        self._subfile.seek(self._aCP + i * 4)
-        [[cp], [next_cp]] = unsigned4.iter_unpack(self._subfile.read(4 * 2))
-        assert next_cp > cp
-        self._subfile.seek(self._aPcd + i * Pcd.size)
-        [_, fc, prm] = Pcd.unpack(self._subfile.read(Pcd.size))
-        assert prm == 0x0000
-        size = next_cp - cp
-        fCompressed = fc >> COMPRESSED_BIT & 1
-        fc &= FC_MASK
-        return Piece(self._doc, size, fCompressed, fc)
+        i = range(len(self._fc))[i]
+        size = self.aCP[i + 1] - self.aCP[i]
+        return Piece(self._doc, size, self._compressed[i], self._fc[i])
+    
+    def find_cp(self, cp):
+        """Index of the piece containing a character position, or None"""
+        i = bisect_right(self.aCP, cp) - 1
+        if i not in range(len(self._fc)):
+            return None
+        return i
 
 class Piece:
     def __init__(self, doc, size, fCompressed, fc):
         self._doc = doc
-        self._decoder = Cp1252Decoder if fCompressed else Utf16Decoder
-        self.code_size = self._decoder.code_size
+        self.decoder = Cp1252Decoder if fCompressed else Utf16Decoder
+        self.code_size = self.decoder.code_size
         self.bytes_remaining = size * self.code_size
         [self.byte_offset, remainder] = divmod(fc, 2 // self.code_size)
         assert not remainder
     
-    def get_reader(self, size=None):
+    def read(self, size=None):
+        """Returns a memoryview of raw bytes, to be decoded by self.decoder"""
         if size is None:
             size = self.bytes_remaining
         else:
             assert not size % self.code_size
+        data = self._doc.view(self.byte_offset, size)
+        if len(data) < size:
+            raise EOFError("Truncated read")
         self.bytes_remaining -= size
-        self._doc.seek(self.byte_offset)
         self.byte_offset += size
-        reader = self._decoder.reader_cls(self._doc, size)
-        return TextIOWrapper(reader, self._decoder.encoding, newline="\r")
+        return data
     
     def skip(self, size):
         self.bytes_remaining -= size
@@ -156,88 +147,132 @@ class Piece:
 class Cp1252Decoder:
     code_size = 1
     encoding = "cp1252"
+    cell_mark = b"\x07"
     
-    class reader_cls(Subfile):
-        def read(self, *args):
-            text = super().read(*args)
-            assert {0x80, 0x8E, 0x9E}.isdisjoint(text)
-            return text
+    @classmethod
+    def decode(cls, data):
+        assert {0x80, 0x8E, 0x9E}.isdisjoint(data)
+        return str(data, cls.encoding)
 
 class Utf16Decoder:
     code_size = 2
     encoding = "utf-16-le"
-    reader_cls = Subfile
+    cell_mark = b"\x07\x00"
+    
+    @classmethod
+    def decode(cls, data):
+        return str(data, cls.encoding)
 
-def parse_prop_list(prl, ole):
+class CellText:
+    """Collects the raw bytes of a table cell, to decode all at once"""
+    
+    def __init__(self):
+        self._parts = list()  # [(decoder, bytearray), ...]
+    
+    def add(self, decoder, data):
+        if self._parts and self._parts[-1][0] is decoder:
+            self._parts[-1][1].extend(data)
+        else:
+            self._parts.append((decoder, bytearray(data)))
+    
+    def getvalue(self):
+        return "".join(decoder.decode(data)
+            for [decoder, data] in self._parts)
+
+def parse_prop_list(grpprl, data=None):
+    """Returns (in_table, is_ttp) from a bytes-like list of sprms
+    
+    The Data stream is needed to follow sprmPHugePapx.
+    """
+    
     in_table = False
     is_ttp = False
-    while True:
-        sprm = prl.read(2)
-        if not sprm:
-            break
-        [sprm] = unsigned2.unpack(sprm)
+    offset = 0
+    while offset < len(grpprl):
+        [sprm] = unsigned2.unpack_from(grpprl, offset)
+        offset += 2
         assert sprm >> SGC_BIT & SGC_MASK in {PARAGRAPH, TABLE}
         spra = sprm >> SPRA_BIT & SPRA_MASK
         sprm &= PROP_MASK
         if sprm == sprmPFInTable:
             assert spra == 1
-            [in_table] = prl.read(1)
+            in_table = grpprl[offset]
             assert in_table in {0, 1}
+            offset += 1
         elif sprm == sprmPFTtp:
             assert spra == 1
-            [is_ttp] = prl.read(1)
+            is_ttp = grpprl[offset]
             assert is_ttp in {0, 1}
+            offset += 1
         elif sprm == sprmPHugePapx:
             assert spra == 3
-            assert ole
-            [offset] = unsigned4.unpack(prl.read())
-            data = ole.openstream("Data")
-            data.seek(offset)
-            [cbGrpprl] = unsigned2.unpack(data.read(2))
-            prl = Subfile(data, cbGrpprl)
-            data = None
-            continue
+            assert data
+            [fc] = unsigned4.unpack_from(grpprl, offset)
+            [cbGrpprl] = unsigned2.unpack(data.view(fc, 2))
+            grpprl = data.view(fc + 2, cbGrpprl)
+            offset = 0
         elif spra == 6:
             if sprm == sprmTDefTable:
-                [cb] = unsigned2.unpack(prl.read(2))
+                [cb] = unsigned2.unpack_from(grpprl, offset)
                 assert cb > 1
-                prl.seek(cb - 1, SEEK_CUR)
+                offset += 2 + cb - 1
             else:
-                [cb] = prl.read(1)
+                cb = grpprl[offset]
+                offset += 1
                 if sprm == sprmPChgTabs and cb == 255:
-                    [cTabs] = prl.read(1)
-                    prl.seek(4 * cTabs, SEEK_CUR)
-                    [cTabs] = prl.read(1)
-                    prl.seek(3 * cTabs, SEEK_CUR)
+                    cTabs = grpprl[offset]
+                    offset += 1 + 4 * cTabs
+                    cTabs = grpprl[offset]
+                    offset += 1 + 3 * cTabs
                 else:
-                    prl.seek(cb, SEEK_CUR)
+                    offset += cb
         else:
-            prl.seek(SPRA_SIZES[spra], SEEK_CUR)
+            offset += SPRA_SIZES[spra]
     return (in_table, is_ttp)
 
-def iter_para_buckets(table, fcPlcfBtePapx, lcbPlcfBtePapx):
-    table.seek(fcPlcfBtePapx)
-    assert lcbPlcfBtePapx > 4
-    [n, remainder] = divmod(lcbPlcfBtePapx - 4, 4 + 4)
-    assert not remainder
-    [fc] = unsigned4.unpack(table.read(4))
-    yield fc
-    aFC1 = table.tell()
-    aPnBtePapx = aFC1 + n * 4
-    for i in range(n):
-        table.seek(aPnBtePapx + i * 4)
-        [pn] = unsigned4.unpack(table.read(4))
-        table.seek(aFC1 + i * 4)
-        [next_fc] = unsigned4.unpack(table.read(4))
-        assert next_fc >= fc
-        yield (fc, next_fc, pn & PN_MASK)
-        fc = next_fc
-    return None
+class ParaBins(Sequence):
+    """Buckets of PlcfBtePapx as (fc, next_fc, pn), with cached FKP pages"""
+    
+    def __init__(self, doc, table, fcPlcfBtePapx, lcbPlcfBtePapx):
+        self._doc = doc
+        assert lcbPlcfBtePapx > 4
+        [n, remainder] = divmod(lcbPlcfBtePapx - 4, 4 + 4)
+        assert not remainder
+        plc = table.view(fcPlcfBtePapx, lcbPlcfBtePapx)
+        self.aFC = array("L", Struct("<{}L".format(n + 1)).unpack_from(plc))
+        assert all(fc <= next_fc
+            for [fc, next_fc] in zip(self.aFC, self.aFC[1:]))
+        self.aPn = array("L", (pn & PN_MASK
+            for pn in Struct("<{}L".format(n)).unpack_from(plc, (n + 1) * 4)))
+        self.page = lru_cache(FKP_CACHE)(self._read_page)
+    
+    def __len__(self):
+        return len(self.aPn)
+    
+    def __getitem__(self, i):
+        i = range(len(self.aPn))[i]
+        return (self.aFC[i], self.aFC[i + 1], self.aPn[i])
+    
+    def find(self, fc):
+        """Index of the bucket covering fc, or None"""
+        i = bisect_right(self.aFC, fc) - 1
+        if i not in range(len(self.aPn)):
+            return None
+        return i
+    
+    def _read_page(self, pn):
+        return self._doc.view(pn * 512, 512)
+    
+    def close(self):
+        """Frees the cached pages, which are views of the memory map"""
+        self.page.cache_clear()
+
+FKP_CACHE = 16
 
-def iter_paras_from_pn(doc, ole, fc, next_fc, pn, target, buckets):
-    while True:  # For each bucket
-        doc.seek(pn * 512)
-        page = doc.read(512)
+def iter_paras_from_bucket(bins, data, i, target):
+    for bucket in range(i, len(bins)):
+        [fc, next_fc, pn] = bins[bucket]
+        page = memoryview(bins.page(pn))
         cpara = page[-1]
         page = page[:-1]
         [rgfc] = unsigned4.unpack_from(page)
@@ -257,34 +292,296 @@ def iter_paras_from_pn(doc, ole, fc, next_fc, pn, target, buckets):
                     else:
                         cb = page[bOffset] * 2
                         bOffset += 1
-                    grpprlInPapx = BytesIO(page[bOffset : bOffset + cb])
-                    [istd] = unsigned2.unpack(grpprlInPapx.read(2))
-                    [in_table, is_ttp] = parse_prop_list(grpprlInPapx, ole)
+                    [istd] = unsigned2.unpack_from(page, bOffset)
+                    grpprlInPapx = page[bOffset + 2 : bOffset + cb]
+                    [in_table, is_ttp] = parse_prop_list(grpprlInPapx, data)
                 else:
                     in_table = False
                     is_ttp = False
                 yield (next_rgfc, in_table, is_ttp)
             fc = next_rgfc
         assert fc == next_fc
-        try:
-            [fc, next_fc, pn] = next(buckets)
-        except StopIteration:
-            break
 
-def iter_paras_from(doc, ole, table, fcPlcfBtePapx, lcbPlcfBtePapx, target):
-    buckets = iter_para_buckets(table, fcPlcfBtePapx, lcbPlcfBtePapx)
-    fc = next(buckets)
-    if target < fc:
+def iter_paras_from(data, bins, target):
+    i = bins.find(target)
+    if i is None:
         return None
-    for [fc, next_fc, pn] in buckets:
-        if next_fc > target:
-            return iter_paras_from_pn(doc, ole, fc, next_fc, pn,
-                target, buckets)
-    return None
+    return iter_paras_from_bucket(bins, data, i, target)
+
+def main(*files, outdir=None, workers=None, table=None, rows=None):
+    """Converts the tables in Word 97 documents to CSV
+    
+    A single document is written to stdout. Otherwise the files may also
+    be directories or glob patterns, and the documents are converted in
+    parallel. With outdir, a CSV file is written there for each document,
+    in subdirectories if documents in different directories share a name.
+    Otherwise all the rows are written to stdout, with the source file
+    name in the first column.
+    
+    For a single document, "table" selects one table, counting from zero,
+    and "rows" selects rows from it as START:STOP. These are read using an
+    index of the tables saved next to the document.
+    """
+    
+    if workers is not None:
+        workers = int(workers)
+    if len(files) == 1 and path.isfile(files[0]) and outdir is None:
+        if table is None:
+            rows = iter_rows(files[0])
+        else:
+            [start, _, stop] = (rows or "").partition(":")
+            start = int(start or 0)
+            stop = int(stop) if stop else None
+            rows = read_rows(files[0], int(table), start, stop)
+        out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
+            newline="", line_buffering=stdout.line_buffering)
+        try:
+            csv.writer(out).writerows(rows)
+        finally:
+            out.detach()
+        return
+    
+    files = list(expand_files(files))
+    failed = batch(files, outdir, workers)
+    if failed:
+        raise SystemExit("{} of {} documents failed".format(
+            failed, len(files)))
+
+def expand_files(files):
+    for file in files:
+        if path.isdir(file):
+            yield from sorted(glob(path.join(escape(file), "*.doc")))
+        else:
+            yield from sorted(glob(file)) or (file,)
+
+def batch(files, outdir=None, workers=None):
+    """Converts documents in a process pool, returning the number failed
+    
+    Errors and timing for each document are reported to stderr. If a
+    worker process dies, the document it was converting is retried on its
+    own, and the other documents are restarted in a new pool.
+    """
+    
+    if outdir is None:
+        out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
+            newline="", line_buffering=stdout.line_buffering)
+        writer = csv.writer(out)
+        names = (None for _ in files)
+    else:
+        names = output_names(files, outdir)
+    try:
+        failed = 0
+        pool = ProcessPoolExecutor(workers)
+        try:
+            # Limit how many results are held waiting to be written
+            limit = 2 * (workers or os.cpu_count() or 1)
+            pending = deque()
+            files = zip(files, names)
+            while True:
+                for [file, name] in files:
+                    future = pool.submit(convert_file, file, name)
+                    pending.append((file, name, future))
+                    if len(pending) >= limit:
+                        break
+                if not pending:
+                    break
+                [file, name, future] = pending.popleft()
+                try:
+                    [rows, seconds, error] = future.result()
+                except BrokenProcessPool:
+                    pool.shutdown()
+                    [rows, seconds, error] = convert_alone(file, name)
+                    pool = ProcessPoolExecutor(workers)
+                    pending = deque((file, name,
+                        pool.submit(convert_file, file, name))
+                        for [file, name, _] in pending)
+                if error is not None:
+                    failed += 1
+                    print("{}: {}".format(file, error), file=stderr)
+                    continue
+                if outdir is None:
+                    for row in rows:
+                        writer.writerow([file] + row)
+                    rows = len(rows)
+                print("{}: {} rows in {:.2f} s".format(file, rows, seconds),
+                    file=stderr)
+        finally:
+            pool.shutdown()
+    finally:
+        if outdir is None:
+            out.detach()
+    return failed
+
+def output_names(files, outdir):
+    """Returns the CSV file names for documents converted into outdir
+    
+    The names are the documents' base names, unless two documents share
+    a base name. Then the paths relative to the documents' common directory
+    are kept as subdirectories of outdir.
+    """
+    
+    names = list(path.splitext(path.basename(file))[0] for file in files)
+    if len(set(name.casefold() for name in names)) < len(names):
+        files = list(path.abspath(file) for file in files)
+        base = path.commonpath(list(path.dirname(file) for file in files))
+        names = list(path.splitext(path.relpath(file, base))[0]
+            for file in files)
+        seen = set()
+        for [file, name] in zip(files, names):
+            if name.casefold() in seen:
+                raise SystemExit("Document listed twice: {}".format(file))
+            seen.add(name.casefold())
+    return list(path.join(outdir, name + ".csv") for name in names)
+
+def convert_alone(file, name=None):
+    """Converts a document in a separate process, catching its death"""
+    with ProcessPoolExecutor(1) as pool:
+        try:
+            return pool.submit(convert_file, file, name).result()
+        except BrokenProcessPool as err:
+            if name is not None:
+                try:
+                    os.remove(name)
+                except FileNotFoundError:
+                    pass
+            error = "{}: {}".format(type(err).__name__, err)
+            return (None, None, error)
+
+def convert_file(file, name=None):
+    """Converts a document in a worker process
+    
+    Returns (rows, seconds, error). If name is None, rows is the list of
+    rows, otherwise they are written to that CSV file and rows is the
+    count.
+    """
+    
+    start = monotonic()
+    try:
+        if name is None:
+            rows = list(iter_rows(file))
+        else:
+            os.makedirs(path.dirname(name), exist_ok=True)
+            with open(name, "w", encoding="UTF-8", newline="") as out:
+                try:
+                    writer = csv.writer(out)
+                    rows = 0
+                    for row in iter_rows(file):
+                        writer.writerow(row)
+                        rows += 1
+                except:
+                    out.close()
+                    os.remove(name)
+                    raise
+    except Exception as err:
+        error = "{}: {}".format(type(err).__name__, err)
+        return (None, monotonic() - start, error)
+    return (rows, monotonic() - start, None)
+
+def CaWordReader(file, fields=None, filter=None):
+    """Castlemaine plant list records from tables in a Word document"""
+    with closing(iter_rows(file)) as rows:
+        yield from ca_records(rows, fields, filter)
+
+def QuadratWordReader(file, fields=None, filter=None):
+    """Viridans quadrat records from tables in a Word document
+    
+    There is no header row in a fixed position, as in the CSV export, but
+    rows of column headings are still recognised and skipped.
+    """
+    with closing(iter_rows(file)) as rows:
+        yield from quad_records(rows, fields, filter, header=False)
+
+def iter_tables(file):
+    """Yields a list of rows for each table in a Word 97 document"""
+    table = list()
+    for row in scan_rows(file):
+        if row is None:
+            if table:
+                yield table
+                table = list()
+        else:
+            table.append(row[1])
+    if table:
+        yield table
+
+def iter_rows(file):
+    """Yields the rows of all the tables in a Word 97 document
+    
+    Each row is a list of the text of its cells.
+    """
+    for row in scan_rows(file):
+        if row is not None:
+            yield row[1]
+
+def table_index(file):
+    """Returns [[starting CP of each row] for each table] for a document
+    
+    The index is saved in a file next to the document, and only rebuilt
+    when the document's size or modification time changes.
+    """
+    
+    stat = os.stat(file)
+    key = dict(version=INDEX_VERSION,
+        size=stat.st_size, mtime=stat.st_mtime_ns)
+    index_file = file + INDEX_SUFFIX
+    try:
+        with open(index_file, encoding="ascii") as reader:
+            index = json.load(reader)
+        if index["key"] == key:
+            return index["tables"]
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, LookupError, TypeError) as err:
+        print("Ignoring table index {}: {}".format(index_file, err),
+            file=stderr)
+    
+    tables = list()
+    table = list()
+    for row in scan_rows(file):
+        if row is None:
+            if table:
+                tables.append(table)
+                table = list()
+        else:
+            table.append(row[0])
+    if table:
+        tables.append(table)
+    try:
+        with open(index_file, "w", encoding="ascii") as writer:
+            json.dump(dict(key=key, tables=tables), writer)
+    except OSError as err:
+        print("Cannot save table index {}: {}".format(index_file, err),
+            file=stderr)
+    return tables
+
+INDEX_SUFFIX = ".tables.json"
+INDEX_VERSION = 1
+
+def read_rows(file, table, start=0, stop=None):
+    """Yields rows from one table, starting straight from the saved index
+    
+    The table, start and stop are counted from zero, and stop is not
+    included.
+    """
+    
+    starts = table_index(file)[table][start:stop]
+    if not starts:
+        return
+    with closing(scan_rows(file, starts[0])) as rows:
+        for _ in starts:
+            [_, row] = next(rows)
+            yield row
 
-def main(file):
-    with open(file, "rb") as file:
-        ole = OleFileIO(file)
+def scan_rows(file, start=None):
+    """Yields (CP, row) for each table row, and None for other paragraphs
+    
+    The CP is the character position where the row starts. Scanning
+    begins at the start CP if given, which should be the start of a
+    paragraph.
+    """
+    with closing(CompoundFile(file)) as ole:
+        for [exctype, msg] in ole.parsing_issues:
+            print("{}: {}".format(exctype.__name__, msg), file=stderr)
         doc = ole.openstream("WordDocument")
         base = FibBase.unpack(doc.read(FibBase.size))
         [wIdent, _, _, _, _, bits_fm, _, _, _, _] = base
@@ -300,76 +597,91 @@ def main(file):
         fibRgFcLcb97 = FibRgFcLcb97.unpack(doc.read(FibRgFcLcb97.size))
         [fcPlcfBtePapx, lcbPlcfBtePapx, fcClx, lcbClx] = fibRgFcLcb97
         table = ole.openstream("{}Table".format(fWhichTblStm))
+        if ole.exists("Data"):
+            data = ole.openstream("Data")
+        else:
+            data = None
         
-        out = TextIOWrapper(stdout.buffer, stdout.encoding, stdout.errors,
-            newline="", line_buffering=stdout.line_buffering)
-        try:
-            writer = csv.writer(out)
-            row = list()
-            cell = None
-            
-            pieces = Pieces(doc, table, fcClx, lcbClx)
-            i = 0
-            while i < len(pieces):  # For each piece starting a paragraph
-                piece = pieces[i]
-                paras = iter_paras_from(doc, ole, table,
-                    fcPlcfBtePapx, lcbPlcfBtePapx, piece.byte_offset)
-                while True:  # For each paragraph in the current piece
-                    # Scan ahead to find how many pieces span this paragraph
-                    j = i
-                    scan_piece = piece
-                    while True:
-                        [end, in_table, is_ttp] = next(paras)
-                        end -= scan_piece.byte_offset
-                        if end <= scan_piece.bytes_remaining:
-                            break
-                        while True:  # For each piece without paragraph info
-                            j += 1
-                            piece = pieces[j]
-                            paras = iter_paras_from(doc, table,
-                                fcPlcfBtePapx, lcbPlcfBtePapx,
-                                scan_piece.byte_offset)
-                            if paras is not None:
-                                break
-                    
-                    # Found a paragraph spanning pieces i-j
-                    if is_ttp:
-                        writer.writerow(row)
-                        row.clear()
-                    if in_table and not is_ttp:
-                        if not cell:
-                            cell = StringIO()
-                        while i < j:
-                            copyfileobj(piece.get_reader(), cell)
-                            i += 1
-                            piece = pieces[i]
-                        assert end
-                        reader = piece.get_reader(end - piece.code_size)
-                        copyfileobj(reader, cell)
-                        mark = piece.get_reader(piece.code_size).read()
-                        if mark == "\x07":
-                            row.append(cell.getvalue())
-                            cell = None
-                        else:
-                            cell.write(mark)
-                    else:
-                        assert not row
-                        assert not cell
-                        if i < j:
-                            i = j
-                            piece = pieces[i]
-                        piece.skip(end)
-                    
-                    if not piece.bytes_remaining:
+        pieces = Pieces(doc, table, fcClx, lcbClx)
+        with closing(ParaBins(doc, table, fcPlcfBtePapx, lcbPlcfBtePapx)) \
+                as bins:
+            yield from scan_pieces(pieces, bins, data, start)
+
+def scan_pieces(pieces, bins, data, start=None):
+    """Yields the results of scan_rows() from the pieces of text
+    
+    This is separate so that its views of the document are freed when it
+    finishes, before the document is closed.
+    """
+    
+    row = list()
+    row_start = None
+    cell = None
+    i = 0
+    if start is not None:
+        i = pieces.find_cp(start)
+        assert i is not None
+    while i < len(pieces):  # For each piece starting a paragraph
+        piece = pieces[i]
+        if start is not None:
+            piece.skip((start - pieces.aCP[i]) * piece.code_size)
+            start = None
+        paras = iter_paras_from(data, bins, piece.byte_offset)
+        while True:  # For each paragraph in the current piece
+            # Scan ahead to find how many pieces span this paragraph
+            j = i
+            scan_piece = piece
+            while True:
+                [end, in_table, is_ttp] = next(paras)
+                end -= scan_piece.byte_offset
+                if end <= scan_piece.bytes_remaining:
+                    break
+                while True:  # For each piece without paragraph info
+                    j += 1
+                    scan_piece = pieces[j]
+                    paras = iter_paras_from(data, bins,
+                        scan_piece.byte_offset)
+                    if paras is not None:
                         break
-                i += 1
-            assert not row
-            assert not cell
-        finally:
-            out.detach()
-        
-        for [exctype, msg] in ole.parsing_issues:
-            print("{}: {}".format(exctype.__name__, msg), file=stderr)
+            
+            # Found a paragraph spanning pieces i-j
+            if is_ttp:
+                yield (row_start, row)
+                row = list()
+            if in_table and not is_ttp:
+                if not row and not cell:
+                    row_start = pieces.aCP[i + 1]
+                    row_start -= piece.bytes_remaining // piece.code_size
+                if not cell:
+                    cell = CellText()
+                while i < j:
+                    cell.add(piece.decoder, piece.read())
+                    i += 1
+                    piece = pieces[i]
+                assert end
+                text = piece.read(end)
+                if text[-piece.code_size:] == piece.decoder.cell_mark:
+                    text = text[:-piece.code_size]
+                    cell.add(piece.decoder, text)
+                    row.append(cell.getvalue())
+                    cell = None
+                else:
+                    cell.add(piece.decoder, text)
+            else:
+                assert not row
+                assert not cell
+                if i < j:
+                    i = j
+                    piece = pieces[i]
+                piece.skip(end)
+                if not in_table:
+                    yield None
+            
+            if not piece.bytes_remaining:
+                break
+        i += 1
+    assert not row
+    assert not cell
 
 if __name__ == "__main__":
     from clifunc import run